@@ -1,22 +1,209 @@
-import asyncio
+import os
+import sys
 import json
+import time
+import asyncio
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
 from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+sys.path.append(os.path.join(REPO_ROOT, 'model'))
+from band_power import compute_power_bands_batch, get_feature_index, resample_signals
+from compact_model import load_compact_model, predict_proba_compact
+
+MODEL_PATH = os.environ.get('ALAREM_MODEL_PATH', os.path.join(REPO_ROOT, 'data', 'models', 'sleep_stage_model.npz'))
+MAX_BATCH_ROWS = 4096 # rows scored in one model call
+MAX_BATCH_DELAY = 0.002 # seconds a batch waits for more requests to coalesce
+MAX_QUEUED_REQUESTS = 1024 # past this, submitting clients wait instead of growing the queue
+MAX_IN_FLIGHT_PER_CLIENT = 64 # past this, a client's socket is not read until earlier requests finish
+WORKER_MODE = os.environ.get('ALAREM_WORKER_MODE', 'thread') # NumPy releases the GIL, 'process' isolates heavier work
+WORKERS = int(os.environ.get('ALAREM_WORKERS', min(4, os.cpu_count() or 1)))
+REQUEST_TIMEOUT = float(os.environ.get('ALAREM_REQUEST_TIMEOUT', 10)) # seconds
+INLINE_PARSE_BYTES = 65536 # larger messages are decoded off the event loop
+
+scoring_state = {} # model used by score_rows and compute_sample_features, per process
+
+class MicroBatcher:
+    """Coalesces concurrent scoring requests into one vectorized model call."""
+
+    def __init__(self, score_batch, max_batch_rows=MAX_BATCH_ROWS, max_batch_delay=MAX_BATCH_DELAY, max_queued_requests=MAX_QUEUED_REQUESTS, max_concurrent_batches=WORKERS):
+        # score_batch is a coroutine function, batches are scored concurrently up to max_concurrent_batches
+        self.score_batch = score_batch
+        self.batch_slots = asyncio.Semaphore(max_concurrent_batches)
+        self.max_batch_rows = max_batch_rows
+        self.max_batch_delay = max_batch_delay
+        self.queue = asyncio.Queue(maxsize=max_queued_requests)
+
+    async def submit(self, rows):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((rows, future)) # backpressure: waits while the queue is full
+        return await future
+
+    async def collect_batch(self):
+        batch = [await self.queue.get()]
+        n_rows = len(batch[0][0])
+        deadline = asyncio.get_running_loop().time() + self.max_batch_delay
+
+        while n_rows < self.max_batch_rows:
+            if self.queue.empty():
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                item = self.queue.get_nowait()
+            batch.append(item)
+            n_rows += len(item[0])
+
+        # requests whose client has gone away are dropped before scoring
+        return [(rows, future) for rows, future in batch if not future.done()]
+
+    async def score(self, batch):
+        try:
+            probabilities = await self.score_batch(np.concatenate([rows for rows, _ in batch]))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self.batch_slots.release()
+
+        start = 0
+        for rows, future in batch:
+            if not future.done():
+                future.set_result(probabilities[start:start + len(rows)].tolist())
+            start += len(rows)
+
+    async def run(self):
+        batch_tasks = set()
+        while True:
+            await self.batch_slots.acquire()
+            batch = await self.collect_batch()
+            if not batch:
+                self.batch_slots.release()
+                continue
+
+            batch_task = asyncio.create_task(self.score(batch))
+            batch_tasks.add(batch_task)
+            batch_task.add_done_callback(batch_tasks.discard)
+
+def init_scoring(model_path=MODEL_PATH):
+    # also the process pool initializer, so every worker holds its own copy of the model
+    compact_model = load_compact_model(model_path)
+    scoring_state['compact_model'] = compact_model
+    scoring_state['features'] = compact_model['features']
+    scoring_state['feature_index'] = get_feature_index(compact_model['features'])
+    scoring_state['sampling_frequency'] = compact_model['metadata']['sampling_frequency']
+    scoring_state['epoch_length'] = compact_model['metadata']['epoch_length']
+
+def score_rows(rows):
+    return predict_proba_compact(scoring_state['compact_model'], rows)
+
+def compute_sample_features(samples, sampling_frequency):
+    # (channels, n_samples) raw EEG resampled to the model's rate and split into whole epochs, one feature row per epoch
+    feature_index = scoring_state['feature_index']
+    model_sampling_frequency = scoring_state['sampling_frequency']
+    samples = resample_signals(np.asarray(samples, dtype=np.float64), sampling_frequency, model_sampling_frequency)
+    samples_per_epoch = int(round(model_sampling_frequency * scoring_state['epoch_length']))
+    n_epochs = samples.shape[1] // samples_per_epoch
+    if n_epochs == 0:
+        raise ValueError(f"need at least {scoring_state['epoch_length']} s of samples per channel for one epoch")
+
+    epochs = samples[:, :n_epochs * samples_per_epoch].reshape(samples.shape[0], n_epochs, samples_per_epoch)
+    power_bands, power_ratios = zip(*(compute_power_bands_batch(channel_epochs, model_sampling_frequency) for channel_epochs in epochs))
+    return np.concatenate([*power_bands, *power_ratios], axis=1)[:, feature_index]
 
 async def addTwoNumber(a: int, b: int) -> int:
     return a + b
 
-async def handler(websocket):
-    async for message in websocket:
-        data = json.loads(message)
-        if data['cmd'] == 'add':
-            result = await addTwoNumber(int(data['a']), int(data['b']))
-            await websocket.send(json.dumps({'result': result}))
+def run_in_worker(executor, function, *args):
+    return asyncio.get_running_loop().run_in_executor(executor, function, *args)
+
+async def run_command(data, batcher, executor):
+    if data['cmd'] == 'add':
+        result = await addTwoNumber(int(data['a']), int(data['b']))
+        return {'result': result}
+    elif data['cmd'] == 'ping':
+        return {'pong': time.time()}
+    elif data['cmd'] in ('score', 'score_samples'):
+        if 'features' not in scoring_state:
+            raise RuntimeError(f'no model available at {MODEL_PATH}')
+        if data['cmd'] == 'score':
+            rows = np.asarray(data['features'], dtype=np.float64).reshape(-1, len(scoring_state['features']))
         else:
-            await websocket.send(json.dumps({'error': 'unknown command'}))
+            rows = await run_in_worker(executor, compute_sample_features, data['samples'], float(data['sfreq']))
+        return {'probabilities': await batcher.submit(rows)}
+    else:
+        return {'error': 'unknown command'}
+
+async def handle_message(websocket, message, batcher, executor):
+    request_id = None
+    try:
+        data = json.loads(message) if len(message) <= INLINE_PARSE_BYTES else await run_in_worker(executor, json.loads, message)
+        request_id = data.get('id')
+        response = await asyncio.wait_for(run_command(data, batcher, executor), REQUEST_TIMEOUT)
+    except asyncio.TimeoutError:
+        response = {'error': f'request timed out after {REQUEST_TIMEOUT} s'}
+    except Exception as e:
+        response = {'error': f'{type(e).__name__}: {e}'}
+
+    if request_id is not None:
+        response['id'] = request_id
+    try:
+        await websocket.send(json.dumps(response))
+    except ConnectionClosed:
+        pass
+
+async def handler(websocket, batcher, executor):
+    # messages are handled concurrently so one client's requests can share batches
+    in_flight = asyncio.Semaphore(MAX_IN_FLIGHT_PER_CLIENT)
+    tasks = set()
+
+    def finish(task):
+        tasks.discard(task)
+        in_flight.release()
+
+    try:
+        async for message in websocket:
+            await in_flight.acquire()
+            task = asyncio.create_task(handle_message(websocket, message, batcher, executor))
+            tasks.add(task)
+            task.add_done_callback(finish)
+    except ConnectionClosed:
+        pass # an abnormal close ends the session like a clean one
+    finally:
+        # the client is gone, closed cleanly or not, so its unfinished requests are cancelled rather than scored
+        for task in list(tasks):
+            task.cancel()
 
 async def main():
-    async with serve(handler, 'localhost', 8765) as server:
-        await server.serve_forever()
+    try:
+        init_scoring()
+    except FileNotFoundError:
+        print(f'No model found at {MODEL_PATH}, scoring commands are disabled')
+
+    # heavy work runs here so the event loop stays free for heartbeats and UI traffic
+    if WORKER_MODE == 'process' and 'features' in scoring_state:
+        executor = ProcessPoolExecutor(max_workers=WORKERS, initializer=init_scoring, initargs=(MODEL_PATH,))
+    else:
+        executor = ThreadPoolExecutor(max_workers=WORKERS)
+
+    batcher = MicroBatcher(partial(run_in_worker, executor, score_rows))
+    batcher_task = asyncio.create_task(batcher.run())
+
+    try:
+        async with serve(partial(handler, batcher=batcher, executor=executor), 'localhost', 8765, max_size=2**24) as server:
+            await server.serve_forever()
+    finally:
+        batcher_task.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -1,102 +1,104 @@
-import serial
-import csv
-import time
-import numpy as np
-import matplotlib.pyplot as plt
-from scipy.fftpack import fft
-from collections import deque
-
-# Serial port configuration
-SERIAL_PORT = "COM7"
-BAUD_RATE = 115200
-
-# Data storage
-TIME_WINDOW = 30  # seconds
-SAMPLE_RATE = 256  # Hz
-BUFFER_SIZE = TIME_WINDOW * SAMPLE_RATE
-
-data_buffer = deque(maxlen=BUFFER_SIZE)
-time_buffer = deque(maxlen=BUFFER_SIZE)
-
-plt.ion()  # Enable interactive mode
-
-def read_serial_data():
-    """Reads data from the serial port and appends it to the buffer and CSV."""
-    with serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1) as ser, open("eeg_data.csv", "w", newline="") as file:
-        writer = csv.writer(file)
-        writer.writerow(["Time", "EEG"])
-        
-        while True:
-            try:
-                line = ser.readline().decode('utf-8').strip()
-                if line.startswith("Time:") and "EEG:" in line:
-                    parts = line.split()
-                    timestamp = float(parts[1])/1000
-                    eeg_value = float(parts[3])/1000000
-                    
-                    writer.writerow([timestamp, eeg_value])
-                    file.flush()
-                    
-                    data_buffer.append(eeg_value)
-                    time_buffer.append(timestamp)
-
-                    if len(data_buffer) % (SAMPLE_RATE/4) == 0:
-                        plot_timedomain()
-
-                    # One Reading
-                    if len(data_buffer) >= BUFFER_SIZE:
-                        print("Plot Generating")
-                        plot_fft()
-                        press = input()
-                        ser.reset_input_buffer()
-                        data_buffer.clear()
-                        time_buffer.clear()
-
-                    # # Continuous Reading
-                    # if len(data_buffer) >= BUFFER_SIZE:
-                    #     print("Plot Generating")
-                    #     plot_fft()
-                    #     data_buffer.clear()
-                    #     time_buffer.clear()
-
-            except Exception as e:
-                print(f"Error: {e}")
-                continue
-
-def plot_timedomain():
-    """Plots EEG data in the time domain in real-time."""
-    if len(data_buffer) == 0:
-        return
-    
-    plt.figure(2)  # Use a consistent figure ID
-    plt.clf()  # Clear the previous plot
-    plt.plot(time_buffer, data_buffer, color="blue")
-    plt.xlabel("Time (s)")
-    plt.ylabel("EEG Amplitude")
-    plt.title("Real-Time EEG Signal")
-    plt.grid()
-    plt.pause(0.001)  # Small pause to allow real-time updating
-
-def plot_fft():
-    """Generates and displays an FFT plot based on the last 30s of data."""
-    if len(data_buffer) < BUFFER_SIZE:
-        return  # Not enough data yet
-    
-    eeg_array = np.array(data_buffer)
-    N = len(eeg_array)
-    T = 1.0 / SAMPLE_RATE  # Sample interval
-    xf = np.fft.fftfreq(N, T)[:N//2]  # Frequency axis
-    yf = np.abs(fft(eeg_array)[:N//2])  # FFT magnitude
-    
-    plt.figure(1)  # Use a consistent figure ID
-    plt.clf()  # Clear the previous plot
-    plt.plot(xf, yf, color="red")
-    plt.xlabel("Frequency (Hz)")
-    plt.ylabel("Amplitude")
-    plt.title("FFT of EEG Data (Last 30s)")
-    plt.grid()
-    
-    plt.pause(0.5)  # Pause to allow rendering
-
-if __name__ == "__main__":
-    read_serial_data()
\ No newline at end of file
+import serial
+import time
+import numpy as np
+import matplotlib.pyplot as plt
+from scipy.fftpack import fft
+from acquisition import SampleRing, AcquisitionThread, RING_SECONDS
+from recording import RecordingWriter
+
+# Serial port configuration
+SERIAL_PORT = "COM7"
+BAUD_RATE = 115200
+CHANNEL_NAMES = ["EEG Fpz-Cz", "EEG Pz-Oz"]  # PhysioNet names, so recordings convert straight to model input
+CHANNELS = len(CHANNEL_NAMES)  # interleaved in each binary frame, see eeg_protocol.py
+
+# Data storage
+TIME_WINDOW = 30  # seconds
+SAMPLE_RATE = 256  # Hz
+BUFFER_SIZE = TIME_WINDOW * SAMPLE_RATE
+PLOT_INTERVAL = 0.25  # seconds between display refreshes
+
+ring = SampleRing(CHANNELS, RING_SECONDS * SAMPLE_RATE)
+
+plt.ion()  # Enable interactive mode
+
+def read_serial_data():
+    """Acquires data on a background thread while this thread records and plots it."""
+    with serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1) as ser, RecordingWriter("eeg_data.rec", SAMPLE_RATE, CHANNEL_NAMES) as recording:
+        acquisition = AcquisitionThread(ser, ring, SAMPLE_RATE)
+        acquisition.start()
+        cursor = 0
+        reading_start = 0
+
+        try:
+            while True:
+                try:
+                    timestamps, samples, cursor, overrun = ring.read_since(cursor)
+                    if overrun:
+                        print(f"Recording fell behind, {overrun} samples lost")
+                    recording.write(samples)  # buffered, written out a block at a time
+
+                    # One Reading
+                    if ring.written - reading_start >= BUFFER_SIZE:
+                        print("Plot Generating")
+                        plot_fft(ring.latest(BUFFER_SIZE)[1][0]/1000000)
+                        press = input()  # acquisition keeps running while this waits
+                        reading_start = ring.written
+                    elif ring.written > reading_start:
+                        # plots follow the first channel
+                        timestamps, samples = ring.latest(ring.written - reading_start)
+                        plot_timedomain(timestamps, samples[0]/1000000)
+
+                    # # Continuous Reading
+                    # if ring.written - reading_start >= BUFFER_SIZE:
+                    #     print("Plot Generating")
+                    #     plot_fft(ring.latest(BUFFER_SIZE)[1][0]/1000000)
+                    #     reading_start = ring.written
+
+                    time.sleep(PLOT_INTERVAL)
+
+                except Exception as e:
+                    print(f"Error: {e}")
+                    continue
+        except KeyboardInterrupt:
+            pass
+        finally:
+            acquisition.stop()
+            print(acquisition.counters())
+
+def plot_timedomain(timestamps, eeg_data):
+    """Plots EEG data in the time domain in real-time."""
+    if len(eeg_data) == 0:
+        return
+    
+    plt.figure(2)  # Use a consistent figure ID
+    plt.clf()  # Clear the previous plot
+    plt.plot(timestamps, eeg_data, color="blue")
+    plt.xlabel("Time (s)")
+    plt.ylabel("EEG Amplitude")
+    plt.title("Real-Time EEG Signal")
+    plt.grid()
+    plt.pause(0.001)  # Small pause to allow real-time updating
+
+def plot_fft(eeg_array):
+    """Generates and displays an FFT plot based on the last 30s of data."""
+    if len(eeg_array) < BUFFER_SIZE:
+        return  # Not enough data yet
+    
+    N = len(eeg_array)
+    T = 1.0 / SAMPLE_RATE  # Sample interval
+    xf = np.fft.fftfreq(N, T)[:N//2]  # Frequency axis
+    yf = np.abs(fft(eeg_array)[:N//2])  # FFT magnitude
+    
+    plt.figure(1)  # Use a consistent figure ID
+    plt.clf()  # Clear the previous plot
+    plt.plot(xf, yf, color="red")
+    plt.xlabel("Frequency (Hz)")
+    plt.ylabel("Amplitude")
+    plt.title("FFT of EEG Data (Last 30s)")
+    plt.grid()
+    
+    plt.pause(0.5)  # Pause to allow rendering
+
+if __name__ == "__main__":
+    read_serial_data()
@@ -1,115 +1,104 @@
-import serial
-import csv
-import time
-import numpy as np
-import matplotlib.pyplot as plt
-from scipy.fftpack import fft
-from collections import deque
-from scipy.signal import butter, filtfilt, iirnotch
-
-# Serial port configuration
-SERIAL_PORT = "COM7"
-BAUD_RATE = 115200
-
-# Data storage
-TIME_WINDOW = 30  # seconds
-SAMPLE_RATE = 256  # Hz
-BUFFER_SIZE = TIME_WINDOW * SAMPLE_RATE
-
-data_buffer = deque(maxlen=BUFFER_SIZE)
-time_buffer = deque(maxlen=BUFFER_SIZE)
-
-plt.ion()  # Enable interactive mode
-
-def read_serial_data():
-    """Reads data from the serial port and appends it to the buffer and CSV."""
-    with serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1) as ser, open("eeg_data_filtered.csv", "w", newline="") as file:
-        writer = csv.writer(file)
-        writer.writerow(["Time", "EEG"])
-        
-        while True:
-            try:
-                line = ser.readline().decode('utf-8').strip()
-                if line.startswith("Time:") and "EEG:" in line:
-                    parts = line.split()
-                    timestamp = float(parts[1])/1000
-                    eeg_value = float(parts[3])/1000000
-                    
-                    writer.writerow([timestamp, eeg_value])
-                    file.flush()
-                    
-                    data_buffer.append(eeg_value)
-                    time_buffer.append(timestamp)
-
-                    if len(data_buffer) % (SAMPLE_RATE/4) == 0:
-                        plot_timedomain()
-
-                    if len(data_buffer) >= BUFFER_SIZE:
-                        print("Plot Generating")
-                        plot_fft()
-                        data_buffer.clear()
-                        time_buffer.clear()
-
-            except Exception as e:
-                print(f"Error: {e}")
-                continue
-
-def apply_filters(data, sample_rate=256, notch_freq=60, bandpass_low=1, bandpass_high=120):
-    """Applies a notch filter at `notch_freq` Hz and a bandpass filter (1-40 Hz) to the EEG data."""
-    
-    # Notch Filter (Remove Power Line Noise)
-    Q = 30.0  # Quality factor (adjust as needed)
-    b_notch, a_notch = iirnotch(notch_freq, Q, sample_rate)
-    data = filtfilt(b_notch, a_notch, data)
-
-    # Bandpass Filter (1Hz–40Hz)
-    order = 4  # Butterworth filter order
-    nyquist = 0.5 * sample_rate
-    low = bandpass_low / nyquist
-    high = bandpass_high / nyquist
-    b_band, a_band = butter(order, [low, high], btype="band")
-    data = filtfilt(b_band, a_band, data)
-
-    return data
-
-def plot_timedomain():
-    """Plots filtered EEG data in the time domain in real-time."""
-    if len(data_buffer) == 0:
-        return
-    
-    filtered_data = apply_filters(np.array(data_buffer), SAMPLE_RATE)
-    
-    plt.figure(2)  # Use a consistent figure ID
-    plt.clf()  # Clear the previous plot
-    plt.plot(time_buffer, filtered_data, color="blue")
-    plt.xlabel("Time (s)")
-    plt.ylabel("Filtered EEG Amplitude")
-    plt.title("Real-Time EEG Signal (Filtered)")
-    plt.grid()
-    plt.pause(0.001)  # Small pause to allow real-time updating
-
-def plot_fft():
-    """Generates and displays an FFT plot based on the last 30s of filtered data."""
-    if len(data_buffer) < BUFFER_SIZE:
-        return  # Not enough data yet
-    
-    eeg_array = np.array(data_buffer)
-    filtered_data = apply_filters(eeg_array, SAMPLE_RATE)
-
-    N = len(filtered_data)
-    T = 1.0 / SAMPLE_RATE  # Sample interval
-    xf = np.fft.fftfreq(N, T)[:N//2]  # Frequency axis
-    yf = np.abs(fft(filtered_data)[:N//2])  # FFT magnitude
-    
-    plt.figure(1)  # Use a consistent figure ID
-    plt.clf()  # Clear the previous plot
-    plt.plot(xf, yf, color="red")
-    plt.xlabel("Frequency (Hz)")
-    plt.ylabel("Amplitude")
-    plt.title("FFT of EEG Data (Last 30s)")
-    plt.grid()
-    
-    plt.pause(0.5)  # Pause to allow rendering
-
-if __name__ == "__main__":
+import serial
+import time
+import numpy as np
+import matplotlib.pyplot as plt
+from scipy.fftpack import fft
+from acquisition import SampleRing, AcquisitionThread, RING_SECONDS
+from recording import RecordingWriter
+from filters import StreamingFilter
+
+# Serial port configuration
+SERIAL_PORT = "COM7"
+BAUD_RATE = 115200
+CHANNEL_NAMES = ["EEG Fpz-Cz", "EEG Pz-Oz"]  # PhysioNet names, so recordings convert straight to model input
+CHANNELS = len(CHANNEL_NAMES)  # interleaved in each binary frame, see eeg_protocol.py
+
+# Data storage
+TIME_WINDOW = 30  # seconds
+SAMPLE_RATE = 256  # Hz
+BUFFER_SIZE = TIME_WINDOW * SAMPLE_RATE
+PLOT_INTERVAL = 0.25  # seconds between display refreshes
+
+ring = SampleRing(CHANNELS, RING_SECONDS * SAMPLE_RATE)
+filtered_ring = SampleRing(CHANNELS, BUFFER_SIZE)  # written only by the display loop
+stream_filter = StreamingFilter(CHANNELS, SAMPLE_RATE)  # notch at 60 Hz, bandpass 1-120 Hz
+
+plt.ion()  # Enable interactive mode
+
+def read_serial_data():
+    """Acquires data on a background thread while this thread records and plots it."""
+    with serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1) as ser, RecordingWriter("eeg_data_filtered.rec", SAMPLE_RATE, CHANNEL_NAMES) as recording:
+        acquisition = AcquisitionThread(ser, ring, SAMPLE_RATE)
+        acquisition.start()
+        cursor = 0
+        reading_start = 0
+
+        try:
+            while True:
+                try:
+                    timestamps, samples, cursor, overrun = ring.read_since(cursor)
+                    if overrun:
+                        print(f"Recording fell behind, {overrun} samples lost")
+                    recording.write(samples)  # buffered, written out a block at a time
+
+                    # each new sample is filtered once, as it arrives
+                    filtered_ring.write(stream_filter.process(samples), timestamps)
+
+                    if ring.written > reading_start:
+                        # plots follow the first channel
+                        timestamps, filtered_data = filtered_ring.latest(ring.written - reading_start)
+                        plot_timedomain(timestamps, filtered_data[0]/1000000)
+
+                    if ring.written - reading_start >= BUFFER_SIZE:
+                        print("Plot Generating")
+                        # a completed epoch is refiltered zero-phase, as filtfilt did before
+                        plot_fft(stream_filter.zero_phase(ring.latest(BUFFER_SIZE)[1][0])/1000000)
+                        reading_start = ring.written
+
+                    time.sleep(PLOT_INTERVAL)
+
+                except Exception as e:
+                    print(f"Error: {e}")
+                    continue
+        except KeyboardInterrupt:
+            pass
+        finally:
+            acquisition.stop()
+            print(acquisition.counters())
+
+def plot_timedomain(timestamps, eeg_data):
+    """Plots filtered EEG data in the time domain in real-time."""
+    if len(eeg_data) == 0:
+        return
+    
+    plt.figure(2)  # Use a consistent figure ID
+    plt.clf()  # Clear the previous plot
+    plt.plot(timestamps, eeg_data, color="blue")
+    plt.xlabel("Time (s)")
+    plt.ylabel("Filtered EEG Amplitude")
+    plt.title("Real-Time EEG Signal (Filtered)")
+    plt.grid()
+    plt.pause(0.001)  # Small pause to allow real-time updating
+
+def plot_fft(filtered_data):
+    """Generates and displays an FFT plot based on the last 30s of filtered data."""
+    if len(filtered_data) < BUFFER_SIZE:
+        return  # Not enough data yet
+
+    N = len(filtered_data)
+    T = 1.0 / SAMPLE_RATE  # Sample interval
+    xf = np.fft.fftfreq(N, T)[:N//2]  # Frequency axis
+    yf = np.abs(fft(filtered_data)[:N//2])  # FFT magnitude
+    
+    plt.figure(1)  # Use a consistent figure ID
+    plt.clf()  # Clear the previous plot
+    plt.plot(xf, yf, color="red")
+    plt.xlabel("Frequency (Hz)")
+    plt.ylabel("Amplitude")
+    plt.title("FFT of EEG Data (Last 30s)")
+    plt.grid()
+    
+    plt.pause(0.5)  # Pause to allow rendering
+
+if __name__ == "__main__":
     read_serial_data()
\ No newline at end of file
@@ -0,0 +1,143 @@
+import time
+import threading
+import numpy as np
+from eeg_protocol import FrameParser
+
+SAMPLE_RATE = 256  # Hz
+RING_SECONDS = 300  # how far a slow consumer can fall behind before it loses samples
+LATE_THRESHOLD = 0.5  # seconds a frame may arrive behind the device clock before it counts as late
+
+class SampleRing:
+    """Preallocated single-writer ring of multichannel samples that readers copy from without locking."""
+
+    def __init__(self, channels, capacity, dtype=np.float32):
+        self.capacity = capacity
+        # every sample is written twice, capacity apart, so any span of up to capacity samples is one contiguous slice
+        self.samples = np.zeros((channels, 2 * capacity), dtype=dtype)
+        self.timestamps = np.zeros(2 * capacity)
+        self.written = 0  # samples fully written, readers only trust data below this
+        self.writing_end = 0  # end of the write in progress, data from writing_end - capacity on may be overwritten
+
+    def write(self, samples, timestamps):
+        """Appends (channels, n) samples with their n timestamps, only ever called from one thread."""
+        start = self.written
+        if samples.shape[1] > self.capacity:
+            start += samples.shape[1] - self.capacity
+            samples = samples[:, -self.capacity:]
+            timestamps = timestamps[-self.capacity:]
+        n_samples = samples.shape[1]
+        self.writing_end = start + n_samples
+
+        position = start % self.capacity
+        first = min(n_samples, self.capacity - position)
+        for offset in (position, position + self.capacity):
+            self.samples[:, offset:offset + first] = samples[:, :first]
+            self.timestamps[offset:offset + first] = timestamps[:first]
+        if n_samples > first:
+            for offset in (0, self.capacity):
+                self.samples[:, offset:offset + n_samples - first] = samples[:, first:]
+                self.timestamps[offset:offset + n_samples - first] = timestamps[first:]
+
+        self.written = start + n_samples
+
+    def read(self, start, stop):
+        """Copies samples [start, stop), or returns None if the writer overwrote any of them during the copy."""
+        position = start % self.capacity
+        samples = self.samples[:, position:position + stop - start].copy()
+        timestamps = self.timestamps[position:position + stop - start].copy()
+        if start < self.writing_end - self.capacity:
+            return None
+        return timestamps, samples
+
+    def latest(self, n_samples):
+        """Copies the newest n_samples (fewer if not yet written) as (timestamps, samples)."""
+        while True:
+            stop = self.written
+            snapshot = self.read(max(0, stop - min(n_samples, self.capacity)), stop)
+            if snapshot is not None:
+                return snapshot
+
+    def read_since(self, cursor):
+        """Copies everything written after cursor, returns (timestamps, samples, new cursor, samples lost to overrun)."""
+        overrun = 0
+        while True:
+            stop = self.written
+            oldest = max(0, self.writing_end - self.capacity)
+            if cursor < oldest:
+                overrun += oldest - cursor
+                cursor = oldest
+            snapshot = self.read(cursor, stop)
+            if snapshot is not None:
+                return (*snapshot, stop, overrun)
+
+class AcquisitionThread(threading.Thread):
+    """Reads EEG frames from the serial port into a SampleRing so consumers never block acquisition."""
+
+    def __init__(self, ser, ring, sample_rate=SAMPLE_RATE, late_threshold=LATE_THRESHOLD):
+        super().__init__(daemon=True)
+        self.ser = ser
+        self.ring = ring
+        self.sample_rate = sample_rate
+        self.late_threshold = late_threshold
+        self.parser = FrameParser()
+        self.stop_event = threading.Event()
+
+        self.samples_received = 0
+        self.samples_dropped = 0
+        self.late_frames = 0
+        self.max_latency = 0.0
+        self.read_errors = 0
+        self.min_clock_offset = None
+        self.last_timestamp_ms = None
+
+    def run(self):
+        while not self.stop_event.is_set():
+            frames_lost = self.parser.frames_lost
+            try:
+                frames = self.parser.read(self.ser)
+            except Exception as e:
+                self.read_errors += 1
+                print(f"Error: {e}")
+                continue
+            arrival = time.monotonic()
+
+            for sequence, timestamp_ms, samples in frames:
+                n_samples = samples.shape[1]
+                timestamps = timestamp_ms/1000 + np.arange(n_samples)/self.sample_rate
+                self.ring.write(samples, timestamps)
+                self.samples_received += n_samples
+                self.check_latency(timestamp_ms, timestamps[-1], arrival)
+
+            if frames:
+                # frames lost to sequence gaps are assumed to be the size of the ones around them
+                self.samples_dropped += (self.parser.frames_lost - frames_lost) * frames[-1][2].shape[1]
+
+    def check_latency(self, timestamp_ms, last_sample_time, arrival):
+        # the smallest host-minus-device clock offset seen is the no-delay baseline
+        if self.last_timestamp_ms is not None and timestamp_ms < self.last_timestamp_ms:
+            self.min_clock_offset = None  # the device clock was reset
+        self.last_timestamp_ms = timestamp_ms
+
+        clock_offset = arrival - last_sample_time
+        if self.min_clock_offset is None or clock_offset < self.min_clock_offset:
+            self.min_clock_offset = clock_offset
+        latency = clock_offset - self.min_clock_offset
+        self.max_latency = max(self.max_latency, latency)
+        if latency > self.late_threshold:
+            self.late_frames += 1
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+    def counters(self):
+        """Returns the loss and timing counters for the stream so far."""
+        return {
+            'samples_received': self.samples_received,
+            'samples_dropped': self.samples_dropped,
+            'late_frames': self.late_frames,
+            'max_latency': self.max_latency,
+            'crc_errors': self.parser.crc_errors,
+            'bytes_skipped': self.parser.bytes_skipped,
+            'read_errors': self.read_errors,
+        }
@@ -0,0 +1,101 @@
+import struct
+import zlib
+import numpy as np
+
+# Frame layout, all little-endian:
+#   sync        2 bytes   0xA5 0x5A
+#   version     uint8
+#   channels    uint8
+#   n_samples   uint16    samples per channel in this block
+#   sequence    uint32    increments by one per frame
+#   timestamp   uint32    device time of the first sample (ms)
+#   payload     int32[n_samples][channels]    EEG in microvolts, interleaved by sample
+#   crc         uint32    CRC-32 (zlib / MbedCRC POLY_32BIT_ANSI) of everything after the sync bytes
+FRAME_SYNC = b'\xa5\x5a'
+FRAME_VERSION = 1
+HEADER_FORMAT = '<2sBBHII'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+CRC_FORMAT = '<I'
+CRC_SIZE = struct.calcsize(CRC_FORMAT)
+SAMPLE_DTYPE = np.dtype('<i4')
+MAX_CHANNELS = 8
+MAX_SAMPLES_PER_FRAME = 1024
+
+def get_frame_size(channels, n_samples):
+    """Returns the size in bytes of a frame carrying n_samples per channel."""
+    return HEADER_SIZE + channels * n_samples * SAMPLE_DTYPE.itemsize + CRC_SIZE
+
+def encode_frame(samples, sequence, timestamp_ms):
+    """Packs a (channels, n_samples) block of microvolt samples into one frame, as the device does."""
+    samples = np.asarray(samples)
+    channels, n_samples = samples.shape
+    header = struct.pack(HEADER_FORMAT, FRAME_SYNC, FRAME_VERSION, channels, n_samples, sequence & 0xFFFFFFFF, timestamp_ms & 0xFFFFFFFF)
+    payload = np.ascontiguousarray(samples.T, dtype=SAMPLE_DTYPE).tobytes()
+    crc = zlib.crc32(payload, zlib.crc32(header[len(FRAME_SYNC):]))
+    return header + payload + struct.pack(CRC_FORMAT, crc)
+
+class FrameParser:
+    """Decodes a byte stream of EEG frames, resyncing on the next sync word after corruption."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.next_sequence = None
+        self.frames = 0
+        self.crc_errors = 0
+        self.bytes_skipped = 0
+        self.frames_lost = 0
+
+    def feed(self, data):
+        """Adds raw bytes and returns a list of (sequence, timestamp_ms, samples) for every complete frame."""
+        self.buffer += data
+        frames = []
+        position = 0
+
+        while True:
+            start = self.buffer.find(FRAME_SYNC, position)
+            if start < 0:
+                # keep a trailing first sync byte, the second may arrive with the next read
+                keep = len(FRAME_SYNC) - 1 if self.buffer.endswith(FRAME_SYNC[:1]) else 0
+                self.bytes_skipped += len(self.buffer) - position - keep
+                position = len(self.buffer) - keep
+                break
+            self.bytes_skipped += start - position
+            position = start
+
+            if len(self.buffer) - position < HEADER_SIZE:
+                break
+            _, version, channels, n_samples, sequence, timestamp_ms = struct.unpack_from(HEADER_FORMAT, self.buffer, position)
+            if version != FRAME_VERSION or not 0 < channels <= MAX_CHANNELS or not 0 < n_samples <= MAX_SAMPLES_PER_FRAME:
+                # not a real header, the sync word was inside a payload
+                position += 1
+                self.bytes_skipped += 1
+                continue
+
+            frame_size = get_frame_size(channels, n_samples)
+            if len(self.buffer) - position < frame_size:
+                break
+            crc_offset = position + frame_size - CRC_SIZE
+            frame_crc, = struct.unpack_from(CRC_FORMAT, self.buffer, crc_offset)
+            if zlib.crc32(memoryview(self.buffer)[position + len(FRAME_SYNC):crc_offset]) != frame_crc:
+                self.crc_errors += 1
+                position += 1
+                self.bytes_skipped += 1
+                continue
+
+            # copied out in one expression, the buffer cannot be resized while a view of it exists
+            frames.append((sequence, timestamp_ms, np.frombuffer(self.buffer, dtype=SAMPLE_DTYPE, count=channels * n_samples, offset=position + HEADER_SIZE).reshape(n_samples, channels).T.copy()))
+
+            if self.next_sequence is not None:
+                gap = (sequence - self.next_sequence) & 0xFFFFFFFF
+                if gap < 0x80000000: # a backwards jump is a device restart, not loss
+                    self.frames_lost += gap
+            self.next_sequence = (sequence + 1) & 0xFFFFFFFF
+            self.frames += 1
+            position += frame_size
+
+        del self.buffer[:position]
+        return frames
+
+    def read(self, ser):
+        """Reads whatever the serial port has waiting (at least one byte) and decodes it."""
+        return self.feed(ser.read(ser.in_waiting or 1))
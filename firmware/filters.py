@@ -0,0 +1,41 @@
+import numpy as np
+from scipy.signal import butter, iirnotch, tf2sos, sosfilt, sosfilt_zi, sosfiltfilt
+
+SAMPLE_RATE = 256  # Hz
+NOTCH_FREQ = 60  # Hz, power line
+NOTCH_Q = 30.0  # Quality factor
+BANDPASS_LOW = 1  # Hz
+BANDPASS_HIGH = 120  # Hz
+BANDPASS_ORDER = 4  # Butterworth filter order
+
+def design_filters(sample_rate=SAMPLE_RATE, notch_freq=NOTCH_FREQ, notch_q=NOTCH_Q, bandpass_low=BANDPASS_LOW, bandpass_high=BANDPASS_HIGH, order=BANDPASS_ORDER):
+    """Returns the notch followed by the Butterworth bandpass as one cascade of second-order sections."""
+    notch_sos = tf2sos(*iirnotch(notch_freq, notch_q, sample_rate))
+    bandpass_sos = butter(order, [bandpass_low, bandpass_high], btype="band", fs=sample_rate, output="sos")
+    return np.vstack([notch_sos, bandpass_sos])
+
+class StreamingFilter:
+    """Filters a multichannel stream chunk by chunk, each sample exactly once, carrying filter state between chunks."""
+
+    def __init__(self, channels, sample_rate=SAMPLE_RATE, **filter_params):
+        self.sos = design_filters(sample_rate, **filter_params)
+        self.channels = channels
+        self.zi = None
+
+    def reset(self):
+        self.zi = None
+
+    def process(self, chunk):
+        """Filters (channels, n) new samples continuing from the previous chunk."""
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if chunk.shape[1] == 0:
+            return chunk
+        if self.zi is None:
+            # start in the steady state for the first sample so the stream does not open with a step transient
+            self.zi = sosfilt_zi(self.sos)[:, None, :] * chunk[None, :, :1]
+        filtered, self.zi = sosfilt(self.sos, chunk, axis=-1, zi=self.zi)
+        return filtered
+
+    def zero_phase(self, epoch):
+        """Forward-backward filters a completed epoch, no phase shift but it needs the whole epoch."""
+        return sosfiltfilt(self.sos, np.asarray(epoch, dtype=np.float64), axis=-1)
@@ -1,20 +1,72 @@
 #include "mbed.h"
+#include "hal/analogin_api.h"
 
-AnalogIn EEG_input(PF_4);
+// Binary sample frames, decoded on the host by firmware/eeg_protocol.py
+#define FRAME_VERSION 1
+#define CHANNELS 2
+#define SAMPLES_PER_FRAME 64
+#define HEADER_SIZE 14
+#define PAYLOAD_SIZE (CHANNELS * SAMPLES_PER_FRAME * 4)
+#define FRAME_SIZE (HEADER_SIZE + PAYLOAD_SIZE + 4)
+#define REFERENCE_VOLTAGE 2.94f
+#define FRAME_READY 1
+
+// AnalogIn locks a mutex on every read, which is not allowed in an ISR, so the ticker reads the ADC through the HAL
+const PinName EEG_pins[CHANNELS] = {PF_4, PF_5};
+analogin_t EEG_inputs[CHANNELS];
 InterruptIn button(BUTTON1);
 DigitalOut led(LED2);
-BufferedSerial serial_port(USBTX, USBRX, 115200);
+BufferedSerial serial_port(USBTX, USBRX, 115200); // TX buffer sized to a whole frame in mbed_app.json
+MbedCRC<POLY_32BIT_ANSI, 32> crc32;
+EventFlags frame_flags;
 
 Ticker ticker;
 Timer timer;
-bool printFlag = false;
-bool buttonFlag = false;
-time_t curr_time;
-tm curr_tm;
-float reading;
+volatile bool buttonFlag = false;
+
+// Ping-pong frames: the ticker fills one while the main thread sends the other
+uint8_t frames[2][FRAME_SIZE];
+volatile int filling = 0;
+volatile int ready = -1; // frame waiting to be sent, -1 when none
+uint32_t sequence = 0;
+int sample_count = 0;
+
+void put_u16(uint8_t *dest, uint16_t value) {
+    dest[0] = value & 0xFF;
+    dest[1] = (value >> 8) & 0xFF;
+}
+
+void put_u32(uint8_t *dest, uint32_t value) {
+    for (int i = 0; i < 4; i++) {
+        dest[i] = (value >> (8 * i)) & 0xFF;
+    }
+}
 
 void TickerISR() {
-    printFlag = true;
+    if (!buttonFlag) {
+        return;
+    }
+    uint8_t *frame = frames[filling];
+    if (sample_count == 0) {
+        put_u32(&frame[10], chrono::duration_cast<chrono::milliseconds>(timer.elapsed_time()).count());
+    }
+    // samples are interleaved by channel, in microvolts
+    for (int channel = 0; channel < CHANNELS; channel++) {
+        int32_t reading = (int32_t)(analogin_read(&EEG_inputs[channel]) * REFERENCE_VOLTAGE * 1000000);
+        put_u32(&frame[HEADER_SIZE + 4 * (sample_count * CHANNELS + channel)], (uint32_t)reading);
+    }
+    sample_count++;
+
+    if (sample_count == SAMPLES_PER_FRAME) {
+        // the sequence advances even when a frame is dropped, so the host counts the gap as lost frames
+        put_u32(&frame[6], sequence++);
+        if (ready < 0) {
+            ready = filling;
+            filling = 1 - filling;
+            frame_flags.set(FRAME_READY);
+        }
+        sample_count = 0;
+    }
 }
 
 void ButtonISR() {
@@ -23,25 +75,36 @@ void ButtonISR() {
     timer.reset();
 }
 
+void send_frame(uint8_t *frame) {
+    // little-endian header: sync, version, channels, samples per channel, then the sequence and timestamp set by the ticker
+    frame[0] = 0xA5;
+    frame[1] = 0x5A;
+    frame[2] = FRAME_VERSION;
+    frame[3] = CHANNELS;
+    put_u16(&frame[4], SAMPLES_PER_FRAME);
+
+    // CRC covers everything after the sync bytes
+    uint32_t crc = 0;
+    crc32.compute(&frame[2], FRAME_SIZE - 6, &crc);
+    put_u32(&frame[FRAME_SIZE - 4], crc);
+
+    serial_port.write(frame, FRAME_SIZE);
+}
+
 // main() runs in its own thread in the OS
 int main()
 {
-    EEG_input.set_reference_voltage(2.94);
-    printFlag = false;
+    for (int channel = 0; channel < CHANNELS; channel++) {
+        analogin_init(&EEG_inputs[channel], EEG_pins[channel]);
+    }
     ticker.attach(&TickerISR, 0.00390625);
     button.fall(&ButtonISR);
     timer.start();
-    //srand(time(NULL)); //del
 
     while (true) {
-        if (printFlag && buttonFlag) {
-            uint32_t elapsed_ms = chrono::duration_cast<chrono::milliseconds>(timer.elapsed_time()).count();
-            reading = EEG_input.read_voltage();
-            // reading = rand()/1000000; //del
-            printf("Time: %d EEG: %d\n", elapsed_ms, (int)(reading*1000000));
-            printFlag = false;
-        }
-        thread_sleep_for(1);
+        // sampling carries on in the ticker while a frame is being written
+        frame_flags.wait_any(FRAME_READY);
+        send_frame(frames[ready]);
+        ready = -1;
     }
 }
-
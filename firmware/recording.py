@@ -0,0 +1,136 @@
+import os
+import struct
+import time
+import numpy as np
+
+# Recording layout, all little-endian:
+#   header      magic, version, channels, sfreq (float64), start time (unix seconds, float64)
+#   names       channels x 16 bytes, utf-8, zero padded
+#   blocks      uint32 n_samples, then float32[channels][n_samples] EEG in microvolts
+# Blocks are only ever appended whole, so a crash can at most leave one partial block at the end.
+RECORDING_MAGIC = b'ALAREC'
+RECORDING_VERSION = 1
+HEADER_FORMAT = '<6sBBdd'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+NAME_SIZE = 16
+BLOCK_HEADER_FORMAT = '<I'
+BLOCK_HEADER_SIZE = struct.calcsize(BLOCK_HEADER_FORMAT)
+SAMPLE_DTYPE = np.dtype('<f4')
+BLOCK_SECONDS = 10  # at most this much is lost if the process dies
+
+def read_recording_header(file):
+    """Reads the header at the start of an open recording file into a dict."""
+    magic, version, channels, sfreq, start_time = struct.unpack(HEADER_FORMAT, file.read(HEADER_SIZE))
+    if magic != RECORDING_MAGIC or version != RECORDING_VERSION:
+        raise ValueError(f'{file.name} is not a version {RECORDING_VERSION} recording')
+    names = [file.read(NAME_SIZE).rstrip(b'\0').decode('utf-8') for _ in range(channels)]
+    return {'channels': channels, 'sfreq': sfreq, 'start_time': start_time, 'channel_names': names, 'data_offset': HEADER_SIZE + channels * NAME_SIZE}
+
+def scan_blocks(file, header):
+    """Returns (offset, n_samples) of every complete block and the end of the last one."""
+    file_size = os.fstat(file.fileno()).st_size
+    block_size = header['channels'] * SAMPLE_DTYPE.itemsize
+    blocks = []
+    end = header['data_offset']
+
+    while end + BLOCK_HEADER_SIZE <= file_size:
+        file.seek(end)
+        n_samples, = struct.unpack(BLOCK_HEADER_FORMAT, file.read(BLOCK_HEADER_SIZE))
+        block_end = end + BLOCK_HEADER_SIZE + n_samples * block_size
+        if n_samples == 0 or block_end > file_size:
+            break
+        blocks.append((end, n_samples))
+        end = block_end
+
+    return blocks, end
+
+def recover_recording(path):
+    """Truncates a recording to its last complete block and returns the number of samples kept per channel."""
+    with open(path, 'r+b') as file:
+        header = read_recording_header(file)
+        blocks, end = scan_blocks(file, header)
+        file.truncate(end)
+    return sum(n_samples for _, n_samples in blocks)
+
+def read_recording(path):
+    """Loads a whole recording as (signals, header), signals shaped (channels, n_samples) in microvolts."""
+    with open(path, 'rb') as file:
+        header = read_recording_header(file)
+        blocks, _ = scan_blocks(file, header)
+        signals = np.empty((header['channels'], sum(n_samples for _, n_samples in blocks)), dtype=np.float32)
+
+        start = 0
+        for offset, n_samples in blocks:
+            file.seek(offset + BLOCK_HEADER_SIZE)
+            signals[:, start:start + n_samples] = np.fromfile(file, dtype=SAMPLE_DTYPE, count=header['channels'] * n_samples).reshape(header['channels'], n_samples)
+            start += n_samples
+
+    return signals, header
+
+class RecordingWriter:
+    """Buffers samples into blocks and appends each full block to a binary recording with one write."""
+
+    def __init__(self, path, sfreq, channel_names, start_time=None, block_seconds=BLOCK_SECONDS, append=False):
+        self.path = path
+        self.channels = len(channel_names)
+        self.block = np.empty((self.channels, int(round(block_seconds * sfreq))), dtype=SAMPLE_DTYPE)
+        self.block_fill = 0
+        self.samples_written = 0
+
+        if append and os.path.exists(path):
+            # picks up after a crash, dropping any partial block left at the end
+            self.samples_written = recover_recording(path)
+            with open(path, 'rb') as file:
+                header = read_recording_header(file)
+            if header['channels'] != self.channels or header['sfreq'] != sfreq:
+                raise ValueError(f'{path} was recorded with {header["channels"]} channels at {header["sfreq"]} Hz')
+            self.file = open(path, 'ab')
+        else:
+            self.file = open(path, 'wb')
+            start_time = time.time() if start_time is None else start_time
+            self.file.write(struct.pack(HEADER_FORMAT, RECORDING_MAGIC, RECORDING_VERSION, self.channels, sfreq, start_time))
+            for name in channel_names:
+                self.file.write(name.encode('utf-8')[:NAME_SIZE].ljust(NAME_SIZE, b'\0'))
+            self.file.flush()
+
+    def write(self, samples):
+        """Adds (channels, n) samples in microvolts, writing out every block they fill."""
+        start = 0
+        while start < samples.shape[1]:
+            n_samples = min(samples.shape[1] - start, self.block.shape[1] - self.block_fill)
+            self.block[:, self.block_fill:self.block_fill + n_samples] = samples[:, start:start + n_samples]
+            self.block_fill += n_samples
+            start += n_samples
+            if self.block_fill == self.block.shape[1]:
+                self.write_block()
+
+    def write_block(self):
+        if self.block_fill == 0:
+            return
+        self.file.write(struct.pack(BLOCK_HEADER_FORMAT, self.block_fill) + np.ascontiguousarray(self.block[:, :self.block_fill]).tobytes())
+        self.file.flush()
+        self.samples_written += self.block_fill
+        self.block_fill = 0
+
+    def close(self):
+        self.write_block()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def convert_recording_to_edf(path, edf_path, channel_names=None):
+    """Writes a recording out as EDF, e.g. as data/physionet/sleep-cassette/SC4ssNE0-PSG.edf for process_edf_file."""
+    # mne is only needed here, so acquisition scripts do not pay for importing it
+    import mne
+    from datetime import datetime, timezone
+
+    signals, header = read_recording(path)
+    info = mne.create_info(channel_names or header['channel_names'], header['sfreq'], ch_types='eeg')
+    raw = mne.io.RawArray(signals.astype(np.float64) / 1000000, info, verbose=False) # mne works in volts
+    raw.set_meas_date(datetime.fromtimestamp(header['start_time'], tz=timezone.utc))
+    mne.export.export_raw(edf_path, raw, fmt='edf', overwrite=True, verbose=False)
+    return edf_path
@@ -0,0 +1,204 @@
+import os
+import sys
+import time
+import threading
+import numpy as np
+from eeg_protocol import encode_frame
+from acquisition import SampleRing, AcquisitionThread, RING_SECONDS
+from filters import StreamingFilter
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(REPO_ROOT, 'model'))
+from preprocessing_functions import load_night_signals, compute_power_bands_for_night
+from band_power import resample_signals
+from realtime_inference import StreamingSleepStager
+from model_training import MODEL_PATH, load_model_bundle
+
+SAMPLE_RATE = 256  # Hz, the device rate replayed nights are resampled to
+SAMPLES_PER_FRAME = 64  # as sent by main.cpp
+REPLAY_CHUNK = 64  # samples per channel handed to the pipeline at a time in direct mode
+PIPE_CAPACITY = 1 << 20  # bytes the virtual serial port holds before the replay source waits
+STALL_TIMEOUT = 2  # seconds without new samples, once the source is done, before a serial replay gives up
+TRAINING_CHECK_TOLERANCE = 0.05  # largest difference from the training-era probability of an epoch the check accepts
+
+def load_replay_night(edf_file, raw_store_dir=None, sample_rate=SAMPLE_RATE):
+    """Loads a PhysioNet night (EDF or raw store) resampled to the device rate, as (channels, n) float32 microvolts."""
+    signals, sampling_frequency, *_ = load_night_signals(edf_file, raw_store_dir)
+    return np.ascontiguousarray(resample_signals(signals, sampling_frequency, sample_rate), dtype=np.float32)
+
+class VirtualSerial:
+    """In-memory stand-in for the serial port, with the read/in_waiting interface the acquisition path uses."""
+
+    def __init__(self, capacity=PIPE_CAPACITY, timeout=1):
+        self.buffer = bytearray()
+        self.capacity = capacity
+        self.timeout = timeout
+        self.closed = False
+        self.condition = threading.Condition()
+
+    @property
+    def in_waiting(self):
+        return len(self.buffer)
+
+    def write(self, data):
+        with self.condition:
+            # backpressure, so replaying as fast as possible cannot outrun the reader's memory
+            self.condition.wait_for(lambda: len(self.buffer) + len(data) <= self.capacity or self.closed)
+            self.buffer += data
+            self.condition.notify_all()
+
+    def read(self, size=1):
+        with self.condition:
+            self.condition.wait_for(lambda: self.buffer or self.closed, self.timeout)
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+            self.condition.notify_all()
+            return data
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+def pace(start, sample_index, sample_rate, speed):
+    # waits until sample_index is due, speed=None replays as fast as possible
+    if speed is not None:
+        delay = start + sample_index / (sample_rate * speed) - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+def send_frames(ser, signals, sample_rate, speed, start, consumed, max_ahead):
+    """Plays the night into the virtual port as device frames, paced like the device."""
+    for sequence, frame_start in enumerate(range(0, signals.shape[1], SAMPLES_PER_FRAME)):
+        frame_stop = min(frame_start + SAMPLES_PER_FRAME, signals.shape[1])
+        pace(start, frame_stop, sample_rate, speed)
+        # a real device cannot run ahead of the pipeline, so faster than real time the replay waits for it
+        while frame_stop - consumed[0] > max_ahead:
+            time.sleep(0.001)
+        timestamp_ms = int(frame_start * 1000 / sample_rate)
+        ser.write(encode_frame(np.round(signals[:, frame_start:frame_stop]), sequence, timestamp_ms))
+
+def get_percentiles(values):
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        return {}
+    return {**{f'p{q}': float(np.percentile(values, q)) for q in (50, 95, 99)}, 'max': float(values.max())}
+
+def replay_night(signals, model_path=MODEL_PATH, sample_rate=SAMPLE_RATE, speed=None, via_serial=False, filter_signal=True, hop_seconds=5, incremental=False):
+    """Streams a night through filter, features and model, speed is a multiple of real time or None for as fast as possible.
+
+    With via_serial the night is also framed, sent over a VirtualSerial and read back by an AcquisitionThread,
+    so the binary protocol and the ring buffer are exercised too.
+    """
+    stager = StreamingSleepStager(model_path, sample_rate, hop_seconds=hop_seconds, incremental=incremental)
+    stream_filter = StreamingFilter(signals.shape[0], sample_rate) if filter_signal else None
+    scores = []
+    chunk_latencies = []
+    hop_lags = []
+
+    def process(chunk, newest_sample):
+        # one chunk through the live path, timed from hand-over to scores
+        chunk_start = time.perf_counter()
+        if stream_filter is not None:
+            chunk = stream_filter.process(chunk)
+        chunk_scores = stager.push(chunk)
+        chunk_latencies.append(time.perf_counter() - chunk_start)
+        if speed is not None:
+            # how far behind the replayed clock the newest score lands
+            hop_lags.extend([time.monotonic() - start - newest_sample / (sample_rate * speed)] * len(chunk_scores))
+        scores.extend(chunk_scores)
+
+    start = time.monotonic()
+    if via_serial:
+        ser = VirtualSerial()
+        ring = SampleRing(signals.shape[0], RING_SECONDS * sample_rate)
+        acquisition = AcquisitionThread(ser, ring, sample_rate)
+        consumed = [0]
+        sender = threading.Thread(target=send_frames, args=(ser, signals, sample_rate, speed, start, consumed, ring.capacity // 2), daemon=True)
+        acquisition.start()
+        sender.start()
+
+        cursor = 0
+        overrun = 0
+        last_progress = time.monotonic()
+        while cursor < signals.shape[1]:
+            _, samples, cursor, chunk_overrun = ring.read_since(cursor)
+            overrun += chunk_overrun
+            if samples.shape[1]:
+                process(samples, cursor)
+                consumed[0] = cursor
+                last_progress = time.monotonic()
+            elif not sender.is_alive() and time.monotonic() - last_progress > STALL_TIMEOUT:
+                break # frames were lost, the rest of the night will not arrive
+            else:
+                time.sleep(0.001)
+
+        sender.join()
+        ser.close()
+        acquisition.stop()
+        counters = {**acquisition.counters(), 'samples_overrun': overrun}
+    else:
+        for chunk_start in range(0, signals.shape[1], REPLAY_CHUNK):
+            chunk_stop = min(chunk_start + REPLAY_CHUNK, signals.shape[1])
+            pace(start, chunk_stop, sample_rate, speed)
+            process(signals[:, chunk_start:chunk_stop], chunk_stop)
+        counters = {}
+    wall_seconds = time.monotonic() - start
+
+    night_seconds = signals.shape[1] / sample_rate
+    return {
+        'sample_rate': sample_rate,
+        'filtered': filter_signal,
+        'night_seconds': night_seconds,
+        'wall_seconds': wall_seconds,
+        'speedup': night_seconds / wall_seconds,
+        'hops': len(scores),
+        'hops_per_second': len(scores) / wall_seconds,
+        'chunk_latency': get_percentiles(chunk_latencies),
+        'hop_lag': get_percentiles(hop_lags),
+        **counters,
+        'samples': np.array([score['sample'] for score in scores]),
+        'probabilities': np.array([score['probability'] for score in scores]),
+        'features': np.array([score['features'] for score in scores]).reshape(len(scores), -1),
+    }
+
+def check_against_training(report, edf_file, model_path=MODEL_PATH, raw_store_dir=None, tolerance=TRAINING_CHECK_TOLERANCE):
+    """Compares a replay's hop probabilities with the model's on train_model-era features of the same epochs.
+
+    Only hops whose window is exactly one epoch of the night are compared. Training features come from the unfiltered
+    signal, so the replay must be run with filter_signal=False.
+    """
+    if report['filtered']:
+        raise ValueError('the replay was filtered, training features are computed from the unfiltered signal')
+    model_bundle = load_model_bundle(model_path)
+    power_bands_df = compute_power_bands_for_night(edf_file, raw_store_dir=raw_store_dir)
+
+    # a hop ending on an epoch boundary covers exactly the epoch before it
+    epoch_size = int(round(model_bundle['epoch_length'] * report['sample_rate']))
+    on_epoch = (report['samples'] % epoch_size == 0) & (report['samples'] // epoch_size <= len(power_bands_df))
+    epochs = report['samples'][on_epoch] // epoch_size - 1
+    features = power_bands_df[model_bundle['features']].to_numpy(dtype=np.float64)[epochs]
+    expected = model_bundle['model'].predict(features / np.asarray(model_bundle['scaler'].scale_, dtype=np.float64))
+    differences = np.abs(report['probabilities'][on_epoch] - expected)
+    # per feature, so a drift the model happens to absorb on this night still shows
+    feature_differences = np.max(np.abs(report['features'][on_epoch] - features) / np.maximum(np.abs(features), np.finfo(np.float64).tiny), axis=0, initial=0)
+
+    return {
+        'epochs': len(epochs),
+        'max_difference': float(differences.max()) if len(epochs) else None,
+        'mean_difference': float(differences.mean()) if len(epochs) else None,
+        'class_agreement': float(np.mean((report['probabilities'][on_epoch] > 0.5) == (expected > 0.5))) if len(epochs) else None,
+        'max_feature_difference': dict(zip(model_bundle['features'], feature_differences.round(4).tolist())),
+        'passed': bool(len(epochs)) and bool(differences.max() <= tolerance),
+    }
+
+if __name__ == "__main__":
+    # run from the repository root, e.g. python firmware/replay.py
+    signals = load_replay_night('SC4001E0-PSG.edf')
+    for via_serial in (False, True):
+        report = replay_night(signals, via_serial=via_serial)
+        print({key: value for key, value in report.items() if key not in ('samples', 'probabilities', 'features')})
+
+    # the unfiltered replay must score every epoch as the model scores its training features
+    report = replay_night(signals, filter_signal=False)
+    print({'training_check': check_against_training(report, 'SC4001E0-PSG.edf')})
@@ -0,0 +1,106 @@
+import os
+import sys
+import numpy as np
+
+# run from the repository root, e.g. python firmware/testing/eeg_protocol.test.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from eeg_protocol import FRAME_SYNC, HEADER_SIZE, FrameParser, encode_frame, get_frame_size
+
+CHANNELS = 2
+SAMPLES_PER_FRAME = 64 # as sent by main.cpp
+
+def make_frames(rng, n_frames, first_sequence=0, n_samples=SAMPLES_PER_FRAME):
+    # microvolt blocks with the sync word planted in some payloads, so the parser meets false syncs inside frames
+    blocks = [rng.integers(-2**31, 2**31, (CHANNELS, n_samples), dtype=np.int64) for _ in range(n_frames)]
+    for block in blocks[::3]:
+        block[0, 5] = int.from_bytes(FRAME_SYNC + b'\x01\x02', 'little', signed=True)
+    frames = [encode_frame(block, first_sequence + i, 4 * i) for i, block in enumerate(blocks)]
+    return frames, blocks
+
+def feed_in_chunks(parser, stream, rng, max_chunk=700):
+    decoded = []
+    position = 0
+    while position < len(stream):
+        chunk_size = int(rng.integers(1, max_chunk))
+        decoded += parser.feed(stream[position:position + chunk_size])
+        position += chunk_size
+    return decoded
+
+def check_decoded(decoded, blocks, sequences, name):
+    assert [sequence for sequence, _, _ in decoded] == list(sequences), f'{name}: decoded sequences {[sequence for sequence, _, _ in decoded]}'
+    for (sequence, _, samples), block in zip(decoded, blocks):
+        assert samples.shape == block.shape and np.array_equal(samples, block), f'{name}: samples of frame {sequence} differ'
+
+def test_round_trip(seed=0):
+    # every split of the stream, including one byte at a time, decodes the same frames
+    rng = np.random.default_rng(seed)
+    frames, blocks = make_frames(rng, 50)
+    stream = b''.join(frames)
+    for max_chunk in (2, 17, 700, len(stream) + 1):
+        parser = FrameParser()
+        check_decoded(feed_in_chunks(parser, stream, rng, max_chunk), blocks, range(50), f'chunks up to {max_chunk}')
+        assert parser.crc_errors == 0 and parser.bytes_skipped == 0 and parser.frames_lost == 0
+    assert len(frames[0]) == get_frame_size(CHANNELS, SAMPLES_PER_FRAME) == 530
+    print('round trip: ok')
+
+def test_corruption(seed=1):
+    # a flipped byte costs exactly the frame it lands in, the parser resyncs on the next frame's sync word
+    rng = np.random.default_rng(seed)
+    frames, blocks = make_frames(rng, 40)
+    corrupted = set(rng.choice(np.arange(1, 39), 8, replace=False).tolist())
+    stream = bytearray()
+    for i, frame in enumerate(frames):
+        frame = bytearray(frame)
+        if i in corrupted:
+            frame[int(rng.integers(len(FRAME_SYNC), len(frame)))] ^= 1 << int(rng.integers(8))
+        stream += frame
+
+    parser = FrameParser()
+    decoded = feed_in_chunks(parser, bytes(stream), rng)
+    kept = [i for i in range(40) if i not in corrupted]
+    check_decoded(decoded, [blocks[i] for i in kept], kept, 'corruption')
+    assert parser.frames_lost == len(corrupted), f'corruption: {parser.frames_lost} frames counted lost'
+    assert parser.frames == len(kept)
+    print(f'corruption: {len(corrupted)} corrupted frames dropped, {parser.crc_errors} crc errors, {parser.bytes_skipped} bytes skipped')
+
+def test_garbage_and_truncation(seed=2):
+    # noise, stray sync words, a half-written frame and a header claiming a huge frame between good frames
+    # the bogus length holds decoding back until that many bytes have arrived, the frames after it are then recovered
+    rng = np.random.default_rng(seed)
+    frames, blocks = make_frames(rng, 24)
+    noise = rng.integers(0, 256, 300, dtype=np.uint8).tobytes()
+    fake_header = FRAME_SYNC + bytes([1, CHANNELS]) + (1000).to_bytes(2, 'little') + bytes(8)
+    stream = noise + frames[0] + FRAME_SYNC + frames[1] + frames[2][:HEADER_SIZE + 40] + frames[3] + fake_header + frames[4] + FRAME_SYNC[:1] + b''.join(frames[5:])
+    assert len(stream) - stream.index(fake_header) > get_frame_size(CHANNELS, 1000)
+
+    parser = FrameParser()
+    decoded = feed_in_chunks(parser, stream, rng, max_chunk=64)
+    kept = [i for i in range(24) if i != 2]
+    check_decoded(decoded, [blocks[i] for i in kept], kept, 'garbage and truncation')
+    assert parser.frames_lost == 1
+    print(f'garbage and truncation: ok, {parser.bytes_skipped} bytes skipped')
+
+def test_trailing_sync_byte():
+    # a read ending on the first sync byte keeps it until the rest of the frame arrives
+    frame = encode_frame(np.zeros((CHANNELS, SAMPLES_PER_FRAME)), 0, 0)
+    parser = FrameParser()
+    assert parser.feed(b'\x00\x00' + frame[:1]) == []
+    assert len(parser.feed(frame[1:])) == 1 and parser.bytes_skipped == 2
+    print('trailing sync byte: ok')
+
+def test_sequence_gaps(seed=3):
+    # dropped frames count as lost, the wrap past 2^32 and a device restart do not
+    rng = np.random.default_rng(seed)
+    frames = [encode_frame(rng.integers(-1000, 1000, (CHANNELS, SAMPLES_PER_FRAME)), sequence, 0) for sequence in (0xFFFFFFFE, 0xFFFFFFFF, 0, 1, 4, 5, 0, 1)]
+    parser = FrameParser()
+    decoded = parser.feed(b''.join(frames))
+    assert [sequence for sequence, _, _ in decoded] == [0xFFFFFFFE, 0xFFFFFFFF, 0, 1, 4, 5, 0, 1]
+    assert parser.frames_lost == 2, f'sequence gaps: {parser.frames_lost} frames counted lost'
+    print('sequence gaps: ok')
+
+if __name__ == "__main__":
+    test_round_trip()
+    test_corruption()
+    test_garbage_and_truncation()
+    test_trailing_sync_byte()
+    test_sequence_gaps()
@@ -0,0 +1,131 @@
+from fractions import Fraction
+import numpy as np
+
+EPOCH_LENGTH = 30 # seconds
+TRAINING_SAMPLING_FREQUENCY = 100 # Hz, the Sleep-EDF EEG rate the training features are computed at
+POWER_BANDS = {
+    'subdelta': (0, 0.5),
+    'delta': (0.5, 4),
+    'theta': (4, 8),
+    'alpha': (8, 12),
+    'beta': (12, 30),
+    'gamma': (30, np.inf),
+}
+
+def compute_power_bands(signal, sampling_frequency):
+    freqs = np.fft.rfftfreq(len(signal), d=1/sampling_frequency)
+    fft_vals = np.abs(np.fft.rfft(signal))**2
+
+    total_power = np.sum(fft_vals)
+    power_bands = {
+        'subdelta': np.sum(fft_vals[freqs < 0.5]),
+        'delta': np.sum(fft_vals[(freqs >= 0.5) & (freqs < 4)]),
+        'theta': np.sum(fft_vals[(freqs >= 4) & (freqs < 8)]),
+        'alpha': np.sum(fft_vals[(freqs >= 8) & (freqs < 12)]),
+        'beta': np.sum(fft_vals[(freqs >= 12) & (freqs < 30)]),
+        'gamma': np.sum(fft_vals[(freqs >= 30)]),
+    }
+    power_ratios = {band: round(power / total_power, 5) for band, power in power_bands.items()}
+    
+    return power_bands, power_ratios
+
+def resample_signals(signals, sampling_frequency, target_frequency):
+    # polyphase resampling along the last axis, band powers are only comparable at the rate the model was trained on
+    ratio = (Fraction(target_frequency) / Fraction(sampling_frequency)).limit_denominator(1000)
+    if ratio == 1:
+        return signals
+    from scipy.signal import resample_poly
+    return resample_poly(signals, ratio.numerator, ratio.denominator, axis=-1)
+
+def get_band_slices(n_samples, sampling_frequency):
+    # rfftfreq is sorted, so every band is a contiguous run of bins
+    freqs = np.fft.rfftfreq(n_samples, d=1/sampling_frequency)
+    return {band: slice(np.searchsorted(freqs, low), np.searchsorted(freqs, high)) for band, (low, high) in POWER_BANDS.items()}
+
+def compute_power_bands_batch(epochs, sampling_frequency):
+    # epochs is an (n_epochs, samples_per_epoch) array, one FFT over axis 1 covers the whole night
+    epochs = np.asarray(epochs, dtype=np.float64)
+    band_slices = get_band_slices(epochs.shape[1], sampling_frequency)
+    fft_vals = np.abs(np.fft.rfft(epochs, axis=1))**2
+
+    total_power = np.sum(fft_vals, axis=1)
+    power_bands = np.column_stack([np.sum(fft_vals[:, band_slice], axis=1) for band_slice in band_slices.values()])
+    power_ratios = np.round(power_bands / total_power[:, None], 5)
+
+    return power_bands, power_ratios
+
+def get_feature_index(features, channels=('anterior', 'posterior')):
+    # positions of named features in concatenate([power_bands.ravel(), power_ratios.ravel()]) for a (channels, samples) window
+    feature_names = [f'{channel}_{band}' for channel in channels for band in POWER_BANDS]
+    feature_names += [f'{channel}_{band}_ratio' for channel in channels for band in POWER_BANDS]
+    return np.array([feature_names.index(feature) for feature in features])
+
+class SlidingBandPower:
+    """Keeps the band powers of a sliding window up to date with a sliding DFT instead of a full FFT per hop."""
+
+    def __init__(self, window_size, sampling_frequency, n_channels=2, resync_interval=None):
+        self.window_size = window_size
+        self.band_slices = get_band_slices(window_size, sampling_frequency)
+        self.last_band = list(POWER_BANDS)[-1]
+        if POWER_BANDS[self.last_band][1] != np.inf:
+            raise ValueError('the last power band must extend to the Nyquist frequency')
+
+        # only bins below the last band are tracked, it is recovered from the total power (Parseval)
+        # DC and Nyquist are tracked because the one-sided total needs them
+        self.tracked_bins = np.arange(self.band_slices[self.last_band].start)
+        if window_size % 2 == 0:
+            self.tracked_bins = np.append(self.tracked_bins, window_size // 2)
+        self.twiddle = np.exp(2j * np.pi * self.tracked_bins / window_size)
+        self.block_twiddles = {}
+
+        self.history = np.zeros((n_channels, window_size), dtype=np.float64)
+        self.spectrum = np.zeros((n_channels, len(self.tracked_bins)), dtype=np.complex128)
+        self.sum_squares = np.zeros(n_channels, dtype=np.float64)
+        self.position = 0
+        self.resync_interval = resync_interval or window_size # a full FFT every so often stops rounding drift
+        self.samples_since_resync = 0
+
+    def get_block_twiddles(self, n_samples):
+        # sample i of an n-sample block is rotated by twiddle^(n - i), the whole spectrum by twiddle^n
+        if n_samples not in self.block_twiddles:
+            exponents = n_samples - np.arange(n_samples)
+            self.block_twiddles[n_samples] = (self.twiddle ** n_samples, np.exp(2j * np.pi * np.outer(exponents, self.tracked_bins) / self.window_size))
+        return self.block_twiddles[n_samples]
+
+    def update(self, samples):
+        samples = np.asarray(samples, dtype=np.float64)
+        for start in range(0, samples.shape[1], self.window_size):
+            block = samples[:, start:start + self.window_size]
+            indices = (self.position + np.arange(block.shape[1])) % self.window_size
+            oldest = self.history[:, indices]
+
+            spectrum_twiddle, sample_twiddles = self.get_block_twiddles(block.shape[1])
+            self.spectrum = self.spectrum * spectrum_twiddle + (block - oldest) @ sample_twiddles
+            self.sum_squares += np.sum(block**2 - oldest**2, axis=1)
+
+            self.history[:, indices] = block
+            self.position = (self.position + block.shape[1]) % self.window_size
+            self.samples_since_resync += block.shape[1]
+
+        if self.samples_since_resync >= self.resync_interval:
+            self.resync()
+
+    def resync(self):
+        window = np.roll(self.history, -self.position, axis=1)
+        self.spectrum = np.fft.rfft(window, axis=1)[:, self.tracked_bins]
+        self.sum_squares = np.sum(window**2, axis=1)
+        self.samples_since_resync = 0
+
+    def power_bands(self):
+        # same (n_channels, n_bands) powers and ratios as compute_power_bands_batch over the current window
+        fft_vals = np.abs(self.spectrum)**2
+        total_power = self.window_size * self.sum_squares + fft_vals[:, 0]
+        if self.window_size % 2 == 0:
+            total_power += fft_vals[:, -1]
+        total_power /= 2
+
+        power_bands = np.column_stack([np.sum(fft_vals[:, self.band_slices[band]], axis=1) for band in POWER_BANDS if band != self.last_band])
+        power_bands = np.column_stack([power_bands, total_power - np.sum(power_bands, axis=1)])
+        power_ratios = np.round(power_bands / total_power[:, None], 5)
+
+        return power_bands, power_ratios
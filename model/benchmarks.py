@@ -0,0 +1,252 @@
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import contextlib
+import numpy as np
+import pandas as pd
+import mne
+import lightgbm
+from preprocessing_functions import EEG_CHANNELS, EPOCH_LENGTH, process_edf_file, compute_power_bands_for_epochs, extract_annotations, generate_labels
+from model_training import FEATURES, train_model, prepare_training_frame
+from compact_model import export_model, load_compact_model, predict_proba_compact
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+BENCHMARK_DIR = os.path.join('data', 'benchmarks')
+BENCHMARK_BASELINE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+BENCHMARK_TOLERANCE = 0.20 # relative slowdown (or memory growth) flagged as a regression
+LATENCY_NOISE_MS = 0.1 # latency changes smaller than this are timer noise, whatever their relative size
+SYNTHETIC_SFREQ = 100 # Hz, as the PhysioNet sleep-cassette EEG
+PREDICTION_CALLS = 500
+
+# per-stage (delta, theta, alpha, sigma) amplitudes in uV, so synthetic nights carry a learnable signal
+STAGE_AMPLITUDES = {
+    'W': (5, 5, 20, 2),
+    '1': (10, 15, 5, 2),
+    '2': (20, 10, 3, 10),
+    '3': (60, 8, 2, 2),
+    'R': (8, 12, 6, 2),
+}
+STAGE_FREQUENCIES = (2, 6, 10, 13) # Hz
+STAGE_TRANSITIONS = 0.1 # chance per epoch of moving to another stage
+
+def get_peak_rss_mb():
+    # process high-water mark so far, ru_maxrss is in KiB on Linux and bytes on macOS
+    if resource is not None:
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak_rss / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+    import psutil
+    return psutil.Process().memory_info().peak_wset / 1024 ** 2
+
+def get_latency_ms(latencies):
+    latencies = np.asarray(latencies) * 1000
+    return {'p50': float(np.percentile(latencies, 50)), 'p95': float(np.percentile(latencies, 95)), 'p99': float(np.percentile(latencies, 99)), 'max': float(latencies.max())}
+
+def make_hypnogram(n_epochs, rng):
+    # a sticky random walk over the stages, with a little movement and unscored time like the real hypnograms
+    stages = list(STAGE_AMPLITUDES)
+    stage_index = np.zeros(n_epochs, dtype=np.int64)
+    changes = rng.random(n_epochs) < STAGE_TRANSITIONS
+    stage_index[changes] = rng.integers(0, len(stages), changes.sum())
+    stage_index = stage_index[np.maximum.accumulate(np.where(changes, np.arange(n_epochs), 0))]
+    hypnogram = np.array(stages)[stage_index].astype(object)
+    hypnogram[rng.random(n_epochs) < 0.01] = 'M'
+    hypnogram[-10:] = '?'
+    return hypnogram
+
+def make_night_signals(hypnogram, channels, sfreq, rng):
+    # white noise plus stage-dependent rhythms, in uV
+    samples_per_epoch = EPOCH_LENGTH * sfreq
+    n_samples = len(hypnogram) * samples_per_epoch
+    amplitudes = np.array([STAGE_AMPLITUDES.get(stage, (5, 5, 5, 5)) for stage in hypnogram], dtype=np.float64)
+    t = np.arange(n_samples) / sfreq
+
+    signals = rng.standard_normal((channels, n_samples)) * 10
+    for band, frequency in enumerate(STAGE_FREQUENCIES):
+        rhythm = np.sin(2 * np.pi * frequency * t + rng.uniform(0, 2 * np.pi))
+        signals[:2] += np.repeat(amplitudes[:, band], samples_per_epoch) * rhythm
+    return signals
+
+def write_synthetic_night(workspace, subject, night, n_epochs, channels, sfreq, rng):
+    """Writes a PhysioNet-style PSG and hypnogram pair into workspace, returns their file names."""
+    psg_file = f'SC4{subject:02d}{night}E0-PSG.edf'
+    hypnogram_file = f'SC4{subject:02d}{night}EC-Hypnogram.edf'
+    night_dir = os.path.join(workspace, 'data', 'physionet', 'sleep-cassette')
+
+    hypnogram = make_hypnogram(n_epochs, rng)
+    channel_names = EEG_CHANNELS + [f'Extra {channel}' for channel in range(channels - len(EEG_CHANNELS))]
+    raw = mne.io.RawArray(make_night_signals(hypnogram, channels, sfreq, rng) / 1e6, mne.create_info(channel_names, sfreq, 'eeg'), verbose=False)
+    mne.export.export_raw(os.path.join(night_dir, psg_file), raw, fmt='edf', overwrite=True, verbose=False)
+
+    # hypnograms are EDF+ annotations, one per run of equal stages
+    run_starts = np.flatnonzero(np.r_[True, hypnogram[1:] != hypnogram[:-1]])
+    run_lengths = np.diff(np.r_[run_starts, n_epochs])
+    descriptions = ['Movement time' if stage == 'M' else f'Sleep stage {stage}' for stage in hypnogram[run_starts]]
+    annotations_raw = mne.io.RawArray(np.zeros((1, n_epochs * EPOCH_LENGTH)), mne.create_info(['Marker'], 1, 'misc'), verbose=False)
+    annotations_raw.set_annotations(mne.Annotations(run_starts * EPOCH_LENGTH, run_lengths * EPOCH_LENGTH, descriptions))
+    mne.export.export_raw(os.path.join(night_dir, hypnogram_file), annotations_raw, fmt='edf', overwrite=True, verbose=False)
+
+    return psg_file, hypnogram_file
+
+def make_synthetic_dataset(workspace, subjects=4, nights_per_subject=2, night_hours=2, channels=2, sfreq=SYNTHETIC_SFREQ, seed=0):
+    """Builds the PhysioNet directory layout under workspace filled with synthetic nights, no download needed."""
+    if channels < len(EEG_CHANNELS):
+        raise ValueError(f'channels must be at least {len(EEG_CHANNELS)}')
+    for data_dir in ('sleep-cassette', 'sleep-telemetry'):
+        os.makedirs(os.path.join(workspace, 'data', 'physionet', data_dir), exist_ok=True)
+
+    rng = np.random.default_rng(seed)
+    n_epochs = int(night_hours * 3600 // EPOCH_LENGTH)
+    return [write_synthetic_night(workspace, subject, night, n_epochs, channels, sfreq, rng) for subject in range(subjects) for night in range(1, nights_per_subject + 1)]
+
+def benchmark_preprocessing(night_files):
+    results = {}
+    latencies = {'process_edf_file': [], 'compute_power_bands_for_epochs': [], 'generate_labels': []}
+    power_bands_dfs = []
+    labels_dfs = []
+    n_epochs = 0
+
+    for psg_file, hypnogram_file in night_files:
+        start = time.perf_counter()
+        night_df, sfreq = process_edf_file(psg_file)
+        latencies['process_edf_file'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        power_bands_dfs.append(compute_power_bands_for_epochs(night_df, sfreq))
+        latencies['compute_power_bands_for_epochs'].append(time.perf_counter() - start)
+        n_epochs += len(power_bands_dfs[-1])
+        del night_df
+
+        annotations = extract_annotations(hypnogram_file)
+        start = time.perf_counter()
+        labels_dfs.append(generate_labels(*annotations))
+        latencies['generate_labels'].append(time.perf_counter() - start)
+
+    for name, stage_latencies in latencies.items():
+        seconds = sum(stage_latencies)
+        results[name] = {'seconds': seconds, 'nights_per_second': len(night_files) / seconds, 'epochs_per_second': n_epochs / seconds, 'latency_ms': get_latency_ms(stage_latencies)}
+
+    labelled_df = pd.concat(power_bands_dfs, ignore_index=True).merge(pd.concat(labels_dfs, ignore_index=True), on='epochId', how='left')
+    labelled_df['sleep_stage'] = labelled_df['sleep_stage'].fillna('N')
+    return results, labelled_df
+
+def benchmark_training(labelled_df, workspace, workers=1):
+    results = {}
+    train_df, scaler = prepare_training_frame(labelled_df, FEATURES)
+    models = {}
+
+    for train_type, name in (('rapid', 'train_model_rapid'), ('cross_validation', 'train_model_loso')):
+        start = time.perf_counter()
+        models[train_type] = train_model(labelled_df, train_type, cv_fraction=1.0, workers=workers, report_sinks=())
+        seconds = time.perf_counter() - start
+        results[name] = {'seconds': seconds, 'epochs_per_second': len(train_df) / seconds}
+
+    # prediction is benchmarked on the rapid model, which was fit with the same scaler as prepare_training_frame gives here
+    compact_path = os.path.join(workspace, 'benchmark_model.npz')
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        export_model(models['rapid'], scaler, FEATURES, compact_path)
+    return results, models['rapid'], train_df[FEATURES].to_numpy(), scaler, load_compact_model(compact_path)
+
+def benchmark_prediction(model, X_scaled, scaler, compact_model, calls=PREDICTION_CALLS):
+    results = {}
+    X = scaler.inverse_transform(X_scaled) # the compact model takes unscaled features
+    booster = model # train_model returns the LightGBM Booster
+
+    for name, predict, rows in (('predict_lightgbm', booster.predict, X_scaled), ('predict_compact', lambda rows: predict_proba_compact(compact_model, rows), X)):
+        latencies = []
+        for row in range(calls):
+            start = time.perf_counter()
+            predict(rows[row % len(rows)][None, :])
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        predict(rows)
+        seconds = time.perf_counter() - start
+        results[name] = {'single_epoch_latency_ms': get_latency_ms(latencies), 'batch_epochs_per_second': len(rows) / seconds}
+    return results
+
+def run_benchmarks(subjects=4, nights_per_subject=2, night_hours=2, channels=2, workers=1, seed=0):
+    """Times preprocessing, labelling, training and prediction on synthetic nights, returns a JSON-ready dict."""
+    config = {'subjects': subjects, 'nights_per_subject': nights_per_subject, 'night_hours': night_hours, 'channels': channels, 'workers': workers, 'seed': seed}
+    cwd = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as workspace:
+        night_files = make_synthetic_dataset(workspace, subjects, nights_per_subject, night_hours, channels, seed=seed)
+        # the pipeline reads data/physionet/... relative to the working directory
+        os.chdir(workspace)
+        try:
+            benchmarks, labelled_df = benchmark_preprocessing(night_files)
+            training_results, model, X_scaled, scaler, compact_model = benchmark_training(labelled_df, workspace, workers)
+            benchmarks.update(training_results)
+            benchmarks.update(benchmark_prediction(model, X_scaled, scaler, compact_model))
+            # the high-water mark only ever grows, so it is reported once for the whole run rather than per stage
+            benchmarks['process'] = {'peak_rss_mb': get_peak_rss_mb()}
+        finally:
+            os.chdir(cwd)
+
+    environment = {'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'numpy': np.__version__, 'lightgbm': lightgbm.__version__, 'mne': mne.__version__}
+    return {'config': config, 'environment': environment, 'benchmarks': benchmarks}
+
+def get_comparable_metrics(benchmark):
+    # (name, value, higher_is_better) for every metric a regression check looks at
+    for metric, value in benchmark.items():
+        if isinstance(value, dict):
+            for percentile in ('p50', 'p95'):
+                yield f'{metric}.{percentile}', value[percentile], False
+        elif metric.endswith('_per_second'):
+            yield metric, value, True
+        elif metric in ('seconds', 'peak_rss_mb'):
+            yield metric, value, False
+
+def compare_benchmarks(results, baseline, tolerance=BENCHMARK_TOLERANCE):
+    """Lists every metric that is more than tolerance worse than the baseline."""
+    regressions = []
+    for name, benchmark in results['benchmarks'].items():
+        baseline_metrics = {metric: value for metric, value, _ in get_comparable_metrics(baseline['benchmarks'].get(name, {}))}
+        for metric, value, higher_is_better in get_comparable_metrics(benchmark):
+            if metric not in baseline_metrics or baseline_metrics[metric] == 0:
+                continue
+            change = value / baseline_metrics[metric] - 1
+            if '_ms.' in metric and abs(value - baseline_metrics[metric]) < LATENCY_NOISE_MS:
+                continue
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions.append({'benchmark': name, 'metric': metric, 'baseline': baseline_metrics[metric], 'current': value, 'change': change})
+    return regressions
+
+def save_benchmarks(results, path):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+    print(f'Benchmark results saved to {path}')
+
+def main():
+    results = run_benchmarks()
+    print(json.dumps(results['benchmarks'], indent=2))
+    save_benchmarks(results, os.path.join(BENCHMARK_DIR, 'latest.json'))
+
+    if not os.path.exists(BENCHMARK_BASELINE):
+        save_benchmarks(results, BENCHMARK_BASELINE)
+        return
+
+    with open(BENCHMARK_BASELINE) as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline['config'] != results['config']:
+        print('Baseline was run with a different configuration, skipping the comparison')
+        return
+
+    regressions = compare_benchmarks(results, baseline)
+    for regression in regressions:
+        print(f"REGRESSION {regression['benchmark']} {regression['metric']}: {regression['baseline']:.4g} -> {regression['current']:.4g} ({regression['change']:+.0%})")
+    if regressions:
+        sys.exit(1)
+    print('No regressions against the baseline')
+
+if __name__ == "__main__":
+    main()
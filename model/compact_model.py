@@ -0,0 +1,120 @@
+import os
+import json
+import numpy as np
+from band_power import EPOCH_LENGTH, TRAINING_SAMPLING_FREQUENCY
+
+# NumPy-only scoring for exported LightGBM models, nothing here imports lightgbm, sklearn or pandas
+COMPACT_MODEL_PATH = os.path.join('data', 'models', 'sleep_stage_model.npz')
+MISSING_TYPES = {'None': 0, 'Zero': 1, 'NaN': 2}
+ZERO_THRESHOLD = 1e-35 # LightGBM's kZeroThreshold
+
+def flatten_trees(tree_info):
+    # every node of every tree in one set of arrays, leaves point back at themselves so traversal can run a fixed number of steps
+    nodes = {'feature': [], 'threshold': [], 'left': [], 'right': [], 'default_left': [], 'missing_type': [], 'value': []}
+    roots = []
+    max_depth = 0
+
+    for tree in tree_info:
+        roots.append(len(nodes['feature']))
+        stack = [(tree['tree_structure'], None, None, 0)]
+        while stack:
+            node, parent, side, depth = stack.pop()
+            node_id = len(nodes['feature'])
+            if parent is not None:
+                nodes[side][parent] = node_id
+            max_depth = max(max_depth, depth)
+
+            if 'leaf_value' in node:
+                for key, value in (('feature', 0), ('threshold', 0.0), ('left', node_id), ('right', node_id), ('default_left', False), ('missing_type', 0), ('value', node['leaf_value'])):
+                    nodes[key].append(value)
+                continue
+
+            if node['decision_type'] != '<=':
+                raise ValueError(f"Unsupported split type {node['decision_type']}, only numerical splits can be exported")
+            for key, value in (('feature', node['split_feature']), ('threshold', node['threshold']), ('left', -1), ('right', -1), ('default_left', node['default_left']), ('missing_type', MISSING_TYPES[node['missing_type']]), ('value', 0.0)):
+                nodes[key].append(value)
+            stack.append((node['right_child'], node_id, 'right', depth + 1))
+            stack.append((node['left_child'], node_id, 'left', depth + 1))
+
+    return {
+        'roots': np.array(roots, dtype=np.int32),
+        'feature': np.array(nodes['feature'], dtype=np.int32),
+        'threshold': np.array(nodes['threshold'], dtype=np.float64),
+        'left': np.array(nodes['left'], dtype=np.int32),
+        'right': np.array(nodes['right'], dtype=np.int32),
+        'default_left': np.array(nodes['default_left'], dtype=bool),
+        'missing_type': np.array(nodes['missing_type'], dtype=np.int8),
+        'value': np.array(nodes['value'], dtype=np.float64),
+        'max_depth': np.array(max_depth, dtype=np.int32),
+    }
+
+def export_model(model, scaler, features, export_path=COMPACT_MODEL_PATH, sampling_frequency=TRAINING_SAMPLING_FREQUENCY, epoch_length=EPOCH_LENGTH):
+    booster = model.booster_ if hasattr(model, 'booster_') else model
+    num_iteration = getattr(model, 'best_iteration_', None) or None
+    model_dump = booster.dump_model(num_iteration=num_iteration)
+
+    objective = model_dump['objective'].split()
+    if objective[0] != 'binary':
+        raise ValueError(f"Unsupported objective {model_dump['objective']}, only binary models can be exported")
+    sigmoid = float(next((part.split(':')[1] for part in objective if part.startswith('sigmoid:')), 1.0))
+
+    if os.path.dirname(export_path): # a bare file name is saved to the working directory
+        os.makedirs(os.path.dirname(export_path), exist_ok=True)
+    np.savez_compressed(
+        export_path,
+        scale=np.asarray(scaler.scale_, dtype=np.float64),
+        features=np.array(features),
+        metadata=np.array(json.dumps({'objective': 'binary', 'sigmoid': sigmoid, 'num_trees': len(model_dump['tree_info']), 'sampling_frequency': sampling_frequency, 'epoch_length': epoch_length})),
+        **flatten_trees(model_dump['tree_info']),
+    )
+    print(f'Compact model exported to {export_path}')
+
+def load_compact_model(export_path=COMPACT_MODEL_PATH):
+    with np.load(export_path, allow_pickle=False) as artifact:
+        compact_model = {key: artifact[key] for key in artifact.files}
+    compact_model['features'] = compact_model['features'].tolist()
+    compact_model['metadata'] = json.loads(str(compact_model['metadata']))
+    compact_model['max_depth'] = int(compact_model['max_depth'])
+    compact_model['children'] = np.column_stack([compact_model['left'], compact_model['right']]).ravel()
+    return compact_model
+
+def walk_trees(compact_model, X):
+    # walks all trees for all rows of X at once, one level per step
+    missing_type = compact_model['missing_type']
+    has_missing_splits = np.any(missing_type != MISSING_TYPES['None'])
+    children = compact_model['children']
+    feature = compact_model['feature']
+    threshold = compact_model['threshold']
+
+    flat_X = X.ravel()
+    row_offsets = np.arange(X.shape[0])[:, None] * X.shape[1]
+    nodes = np.broadcast_to(compact_model['roots'], (X.shape[0], len(compact_model['roots']))).copy()
+
+    for _ in range(compact_model['max_depth']):
+        values = flat_X[row_offsets + feature[nodes]]
+        if has_missing_splits:
+            node_missing_type = missing_type[nodes]
+            is_nan = np.isnan(values)
+            values = np.where(is_nan & (node_missing_type != MISSING_TYPES['NaN']), 0.0, values)
+            is_missing = ((node_missing_type == MISSING_TYPES['NaN']) & is_nan) | ((node_missing_type == MISSING_TYPES['Zero']) & (np.abs(values) <= ZERO_THRESHOLD))
+            go_right = np.where(is_missing, ~compact_model['default_left'][nodes], ~(values <= threshold[nodes]))
+        else:
+            go_right = ~(values <= threshold[nodes])
+        nodes = children[2 * nodes + go_right]
+
+    # cumulative sum adds the trees in order, as LightGBM does
+    return np.cumsum(compact_model['value'][nodes], axis=1)[:, -1]
+
+def predict_raw_compact(compact_model, X, batch_size=1024):
+    X = np.atleast_2d(np.asarray(X, dtype=np.float64)) / compact_model['scale']
+    if not np.any(compact_model['missing_type'] == MISSING_TYPES['NaN']):
+        X = np.where(np.isnan(X), 0.0, X) # LightGBM reads NaN as 0 unless a split treats NaN as missing
+    if X.shape[0] == 0:
+        return np.zeros(0)
+
+    # row batches keep the per-level working set in cache
+    return np.concatenate([walk_trees(compact_model, X[start:start + batch_size]) for start in range(0, X.shape[0], batch_size)])
+
+def predict_proba_compact(compact_model, X):
+    # probability of N1/N2 sleep for each row of X (unscaled features in compact_model['features'] order)
+    return 1 / (1 + np.exp(-compact_model['metadata']['sigmoid'] * predict_raw_compact(compact_model, X)))
@@ -0,0 +1,68 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
+import lightgbm as lgb
+from feature_cache import write_atomic
+
+DATASET_CACHE_DIR = os.path.join('data', 'physionet', 'dataset_cache')
+DATASET_PARAMS = {'verbose': -1} # binning parameters such as max_bin go here, they are part of the cache key
+DATASET_CACHE_KEEP = 4 # most recently used binned datasets kept on disk
+DATASET_CACHE_GRACE = 3600 # seconds, a binary used this recently may still be opened by another run's workers and is never evicted
+
+def get_dataset_key(X, y, features, scaler, dataset_params=DATASET_PARAMS):
+    # anything that changes the bins or the rows they were built from changes the key
+    key_hash = hashlib.blake2b(digest_size=16)
+    key_data = {'features': list(features), 'params': dataset_params, 'lightgbm': lgb.__version__, 'shape': X.shape, 'dtype': X.dtype.str, 'label_dtype': y.dtype.str}
+    key_hash.update(json.dumps(key_data, sort_keys=True).encode())
+    key_hash.update(np.ascontiguousarray(scaler.scale_, dtype=np.float64).tobytes())
+    key_hash.update(np.ascontiguousarray(X).data)
+    key_hash.update(np.ascontiguousarray(y).data)
+    return key_hash.hexdigest()
+
+def get_dataset_path(dataset_key):
+    return os.path.join(DATASET_CACHE_DIR, f'{dataset_key}.bin')
+
+def load_dataset(dataset_path, dataset_params=DATASET_PARAMS):
+    # the binary holds the bin mappers, binned features and labels, no raw rows
+    return lgb.Dataset(dataset_path, params=dataset_params).construct()
+
+def evict_dataset_cache(keep=DATASET_CACHE_KEEP, grace=DATASET_CACHE_GRACE):
+    # runs in parallel sweeps evict side by side, so entries may vanish under each other
+    entries = []
+    for entry in os.scandir(DATASET_CACHE_DIR):
+        try:
+            if entry.name.endswith('.bin'):
+                entries.append((entry.stat().st_mtime, entry.path))
+        except FileNotFoundError:
+            pass
+
+    now = time.time()
+    for mtime, path in sorted(entries, reverse=True)[keep:]:
+        if now - mtime < grace:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def get_training_dataset(X, y, features, scaler, dataset_params=DATASET_PARAMS):
+    """Returns the binned Dataset over all rows and its path, loaded from disk when X, y, features and scaler are unchanged."""
+    dataset_path = get_dataset_path(get_dataset_key(X, y, features, scaler, dataset_params))
+    try:
+        os.utime(dataset_path) # mark as recently used, which also keeps it out of eviction while this run's workers load it
+        return load_dataset(dataset_path, dataset_params), dataset_path
+    except FileNotFoundError:
+        pass
+
+    dataset = lgb.Dataset(X, label=y, feature_name=list(features), params=dataset_params, free_raw_data=False).construct()
+    os.makedirs(DATASET_CACHE_DIR, exist_ok=True)
+    write_atomic(dataset_path, dataset.save_binary)
+    evict_dataset_cache()
+    return dataset, dataset_path
+
+def clear_dataset_cache():
+    if os.path.isdir(DATASET_CACHE_DIR):
+        for entry in os.scandir(DATASET_CACHE_DIR):
+            os.remove(entry.path)
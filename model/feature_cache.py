@@ -0,0 +1,83 @@
+import os
+import json
+import shutil
+import hashlib
+import pandas as pd
+
+FEATURE_CACHE_DIR = os.path.join('data', 'physionet', 'feature_cache')
+FEATURE_CACHE_VERSION = 1 # bump when the feature code changes in a way the key can't see
+FEATURE_CACHE_MAX_BYTES = 1_000_000_000
+
+def hash_file(file_path, chunk_size=1 << 20):
+    # hashes are remembered per file against (size, mtime) so unchanged recordings are not re-read
+    stat = os.stat(file_path)
+    memo_path = os.path.join(FEATURE_CACHE_DIR, 'hashes', os.path.basename(file_path) + '.json')
+    if os.path.exists(memo_path):
+        with open(memo_path) as memo_file:
+            memo = json.load(memo_file)
+        if memo['size'] == stat.st_size and memo['mtime_ns'] == stat.st_mtime_ns:
+            return memo['hash']
+
+    file_hash = hashlib.blake2b()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            file_hash.update(chunk)
+    file_hash = file_hash.hexdigest()
+
+    def write_memo(path):
+        with open(path, 'w') as memo_file:
+            json.dump({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': file_hash}, memo_file)
+
+    os.makedirs(os.path.dirname(memo_path), exist_ok=True)
+    write_atomic(memo_path, write_memo)
+
+    return file_hash
+
+def get_cache_key(file_path, **feature_params):
+    key_data = {'file': hash_file(file_path), 'version': FEATURE_CACHE_VERSION, **feature_params}
+    return hashlib.blake2b(json.dumps(key_data, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+def get_cache_path(cache_key):
+    return os.path.join(FEATURE_CACHE_DIR, 'features', f'{cache_key}.pkl')
+
+def write_atomic(path, write_function):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    write_function(tmp_path)
+    os.replace(tmp_path, path)
+
+def load_cached_features(cache_key):
+    cache_path = get_cache_path(cache_key)
+    if not os.path.exists(cache_path):
+        return None
+
+    os.utime(cache_path) # mark as recently used for eviction
+    return pd.read_pickle(cache_path)
+
+def save_cached_features(cache_key, features_df):
+    cache_path = get_cache_path(cache_key)
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    write_atomic(cache_path, features_df.to_pickle)
+
+def evict_feature_cache(max_bytes=FEATURE_CACHE_MAX_BYTES):
+    # least recently used entries go first until the cache fits
+    features_dir = os.path.join(FEATURE_CACHE_DIR, 'features')
+    if not os.path.isdir(features_dir):
+        return 0
+
+    entries = [entry for entry in os.scandir(features_dir) if entry.name.endswith('.pkl')]
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    cache_size = sum(entry.stat().st_size for entry in entries)
+
+    evicted = 0
+    for entry in entries:
+        if cache_size <= max_bytes:
+            break
+        cache_size -= entry.stat().st_size
+        os.remove(entry.path)
+        evicted += 1
+
+    return evicted
+
+def clear_feature_cache():
+    if os.path.isdir(FEATURE_CACHE_DIR):
+        shutil.rmtree(FEATURE_CACHE_DIR)
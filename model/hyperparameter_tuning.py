@@ -0,0 +1,100 @@
+import os
+import numpy as np
+import optuna
+from lightgbm import LGBMClassifier, early_stopping
+from sklearn.metrics import matthews_corrcoef
+from model_training import FEATURES, LABEL, MODEL_PARAMS, fold_data, prepare_training_frame, build_fold_arrays, init_fold_worker
+
+TUNING_STORAGE = os.path.join('data', 'physionet', 'hyperparameter_tuning.db')
+VALIDATION_FRACTION = 0.15 # share of each fold's training people held back for early stopping
+
+def suggest_params(trial, max_estimators):
+    # n_estimators is only a ceiling, each fold stops early on its validation_people, never on the test person
+    return {
+        **MODEL_PARAMS,
+        'num_leaves': trial.suggest_int('num_leaves', 15, 255, log=True),
+        'learning_rate': trial.suggest_float('learning_rate', 0.01, 0.3, log=True),
+        'n_estimators': max_estimators,
+        'min_child_samples': trial.suggest_int('min_child_samples', 5, 200, log=True),
+        'colsample_bytree': trial.suggest_float('colsample_bytree', 0.5, 1.0),
+        'reg_alpha': trial.suggest_float('reg_alpha', 1e-3, 10.0, log=True),
+        'reg_lambda': trial.suggest_float('reg_lambda', 1e-3, 10.0, log=True),
+    }
+
+def get_validation_people(n_people, seed, validation_fraction=VALIDATION_FRACTION):
+    # per fold, people drawn from the training side only, the held-out person never steers early stopping
+    validation_people = {}
+    for person_code in range(n_people):
+        rng = np.random.default_rng([seed, person_code])
+        candidates = np.delete(np.arange(n_people), person_code)
+        validation_people[person_code] = rng.choice(candidates, max(1, int(round(len(candidates) * validation_fraction))), replace=False)
+    return validation_people
+
+def evaluate_fold(person_code, validation_people, model_params, n_jobs, early_stopping_rounds):
+    X = fold_data['X']
+    y = fold_data['y']
+    test_rows = fold_data['person_rows'][fold_data['person_bounds'][person_code]:fold_data['person_bounds'][person_code + 1]]
+    is_validation = np.isin(fold_data['person_codes'], validation_people)
+    validation_rows = np.flatnonzero(is_validation)
+    fit_rows = np.flatnonzero(~is_validation & (fold_data['person_codes'] != person_code))
+
+    # the tree count is chosen on the validation people, the MCC is scored on the held-out person alone
+    model = LGBMClassifier(**model_params, n_jobs=n_jobs, verbose=-1)
+    model.fit(X[fit_rows], y[fit_rows], eval_set=[(X[validation_rows], y[validation_rows])], eval_metric='binary_logloss', callbacks=[early_stopping(early_stopping_rounds, verbose=False)])
+
+    return matthews_corrcoef(y[test_rows], model.predict(X[test_rows])), model.best_iteration_
+
+def make_objective(fold_order, validation_people, max_estimators, n_jobs, early_stopping_rounds):
+    def objective(trial):
+        model_params = suggest_params(trial, max_estimators)
+        fold_mccs = []
+        best_iterations = []
+
+        # each fold is one rung of resource, the pruner stops trials that fall behind on the folds seen so far
+        for step, person_code in enumerate(fold_order):
+            mcc, best_iteration = evaluate_fold(person_code, validation_people[person_code], model_params, n_jobs, early_stopping_rounds)
+            fold_mccs.append(mcc)
+            best_iterations.append(best_iteration)
+            trial.report(float(np.mean(fold_mccs)), step)
+            if trial.should_prune():
+                raise optuna.TrialPruned()
+
+        trial.set_user_attr('n_estimators', int(np.median(best_iterations)))
+        return float(np.mean(fold_mccs))
+
+    return objective
+
+def tune_hyperparameters(labelled_epochs_power_bands_df, n_trials=100, sampler='bayesian', max_folds=None, workers=1, max_estimators=2000, early_stopping_rounds=50, study_name='lgbm-loso', storage=TUNING_STORAGE, seed=42):
+    train_df, _ = prepare_training_frame(labelled_epochs_power_bands_df, FEATURES)
+    fold_arrays, people = build_fold_arrays(train_df, FEATURES, LABEL)
+    del train_df
+
+    # trials share one fold order so their intermediate scores are comparable at every rung
+    fold_order = np.random.default_rng(seed).permutation(len(people))[:max_folds]
+    validation_people = get_validation_people(len(people), seed)
+    threads_per_trial = max(1, (os.cpu_count() or 1) // workers)
+
+    study = optuna.create_study(
+        study_name=study_name,
+        storage=f'sqlite:///{storage}',
+        load_if_exists=True, # reruns resume the study from disk
+        direction='maximize',
+        sampler=optuna.samplers.TPESampler(seed=seed) if sampler == 'bayesian' else optuna.samplers.RandomSampler(seed=seed),
+        pruner=optuna.pruners.SuccessiveHalvingPruner(min_resource=1, reduction_factor=3),
+    )
+
+    # LightGBM releases the GIL, so trials run in threads over the same fold arrays
+    init_fold_worker(fold_arrays)
+    try:
+        study.optimize(make_objective(fold_order, validation_people, max_estimators, threads_per_trial, early_stopping_rounds), n_trials=n_trials, n_jobs=workers)
+    finally:
+        fold_data.clear()
+
+    print(f"Best LOSO MCC: {study.best_value}")
+    print(f"Best Parameters: {get_tuned_params(study)}")
+
+    return study
+
+def get_tuned_params(study):
+    # MODEL_PARAMS with the best trial's values, ready for train_model(model_params=...)
+    return {**MODEL_PARAMS, **study.best_params, 'n_estimators': study.best_trial.user_attrs['n_estimators']}
@@ -1,16 +1,21 @@
 from preprocessing_functions import *
 from model_training import *
+from training_report import *
 
 def main():
-    all_epochs_power_bands_df = preprocess_features(preprocess_features=False, download_files=False)
-    labelled_epochs_power_bands_df = preprocess_labels(all_epochs_power_bands_df, preprocess_labels=False, download_files=False)
+    regenerate_labels = False
+    # the labelled table already holds the feature columns, so the features table is only read when labels are regenerated
+    all_epochs_power_bands_df = preprocess_features(preprocess_features=False, download_files=False) if regenerate_labels else None
+    labelled_epochs_power_bands_df = preprocess_labels(all_epochs_power_bands_df, preprocess_labels=regenerate_labels, download_files=False, columns=TRAINING_COLUMNS)
 
     # print(labelled_epochs_power_bands_df)
     # print(labelled_epochs_power_bands_df.describe().T)
     # print(labelled_epochs_power_bands_df['sleep_stage'].value_counts())
 
     # Train the model
-    model = train_model(labelled_epochs_power_bands_df, train_type='rapid')
+    # metrics and the report figure go to data/reports, nothing blocks on a plot window
+    report_writer = ReportWriter(get_report_dir('rapid'), summary_path=os.path.join(REPORTS_DIR, 'summary.csv'), save_figure=True)
+    model = train_model(labelled_epochs_power_bands_df, train_type='rapid', report_sinks=(print_report, report_writer))
 
     return
 
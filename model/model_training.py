@@ -1,252 +1,214 @@
+import os
 import time
+import joblib
+import numpy as np
 import pandas as pd
-import xgboost as xgb
 from sklearn.model_selection import train_test_split
-from sklearn.linear_model import LogisticRegression
-from sklearn.tree import DecisionTreeClassifier
-from sklearn.metrics import accuracy_score, roc_auc_score, roc_curve, precision_score, recall_score, f1_score, log_loss, confusion_matrix, precision_recall_curve, auc, matthews_corrcoef
-from lightgbm import LGBMClassifier
-from sklearn.neural_network import MLPClassifier
-from sklearn.preprocessing import MinMaxScaler, StandardScaler, RobustScaler, MaxAbsScaler
-import matplotlib.pyplot as plt
-import seaborn as sns
+import lightgbm as lgb
+from sklearn.preprocessing import MaxAbsScaler
 from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
+from compact_model import export_model
+from band_power import EPOCH_LENGTH, TRAINING_SAMPLING_FREQUENCY
+from multiprocessing.shared_memory import SharedMemory
+from dataset_cache import get_training_dataset, load_dataset
+from training_metrics import get_split_metrics, pool_fold_metrics
+from training_report import print_report
+
+FEATURES = ['anterior_subdelta', 'anterior_delta', 'anterior_theta', 'anterior_alpha', 'anterior_beta', 'anterior_gamma', 
+            'posterior_subdelta', 'posterior_delta', 'posterior_theta', 'posterior_alpha', 'posterior_beta', 'posterior_gamma',
+            'anterior_delta_ratio', 'posterior_delta_ratio', 'anterior_theta_ratio', 'posterior_theta_ratio',
+            'anterior_alpha_ratio', 'posterior_alpha_ratio', 'anterior_beta_ratio', 'posterior_beta_ratio',
+            'anterior_gamma_ratio', 'posterior_gamma_ratio']
+LABEL = 'sleep_stage'
+TRAINING_COLUMNS = ['type', 'subject', LABEL] + FEATURES # all train_model needs from the labelled table
+MODEL_PARAMS = {
+    'boosting_type': 'gbdt',
+    'num_leaves': 131,
+    'max_depth': -1,
+    'learning_rate': 0.1,
+    'n_estimators': 375,
+    'objective': 'binary',
+    'reg_alpha': 0.9,
+    'reg_lambda': 0.1
+}
+
+def get_person_column(df):
+    # one person per data type and subject, e.g. c00 for cassette subject 00
+    if 'type' in df.columns and 'subject' in df.columns:
+        return df['type'].astype(str).str[0] + df['subject'].astype(str).str.zfill(2)
+    return df['epochId'].apply(lambda x: x.split('-')[0][0] + x.split('-')[1])
+
+MODEL_PATH = os.path.join('data', 'models', 'sleep_stage_model.joblib')
+
+def save_model(model, scaler, model_path=MODEL_PATH, features=FEATURES, sampling_frequency=TRAINING_SAMPLING_FREQUENCY, epoch_length=EPOCH_LENGTH):
+    # the signal rate and epoch length go with the model, features from any other rate or window are on another scale
+    if os.path.dirname(model_path):
+        os.makedirs(os.path.dirname(model_path), exist_ok=True)
+    joblib.dump({'model': model, 'scaler': scaler, 'features': features, 'sampling_frequency': sampling_frequency, 'epoch_length': epoch_length}, model_path)
+    print(f'Model saved to {model_path}')
+
+def load_model_bundle(model_path=MODEL_PATH):
+    # model, scaler, features, and the sampling_frequency and epoch_length its features were computed at
+    return joblib.load(model_path)
+
+def load_model(model_path=MODEL_PATH):
+    # returns the fitted model, its scaler and the feature order they expect
+    model_bundle = load_model_bundle(model_path)
+    return model_bundle['model'], model_bundle['scaler'], model_bundle['features']
+
+fold_data = {} # per-worker fold arrays, set by init_fold_worker
+
+def build_fold_arrays(train_df, features, label):
+    # everything the folds need, materialized once: contiguous X, binary y and each person's row indices
+    person_codes, people = pd.factorize(train_df['person'])
+    person_rows = np.argsort(person_codes, kind='stable')
+    fold_arrays = {
+        'X': np.ascontiguousarray(train_df[features].to_numpy()),
+        'y': np.isin(train_df[label].to_numpy(dtype=str), ('1', '2')).astype(np.int64),
+        'person_codes': person_codes,
+        'person_rows': person_rows,
+        'person_bounds': np.searchsorted(person_codes[person_rows], np.arange(len(people) + 1)),
+    }
+    return fold_arrays, people
+
+def share_fold_arrays(fold_arrays):
+    shared_memory_blocks = []
+    shared_arrays = {}
+    for name, array in fold_arrays.items():
+        shared_memory = SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shared_memory.buf)[...] = array
+        shared_memory_blocks.append(shared_memory)
+        shared_arrays[name] = (shared_memory.name, array.shape, array.dtype.str)
+    return shared_memory_blocks, shared_arrays
+
+def init_fold_worker(fold_arrays, shared=False, dataset=None):
+    # dataset is the binned Dataset over all rows, or the path of its cached binary when the worker is another process
+    fold_data.clear()
+    fold_data['shared_memory'] = []
+    for name, array in fold_arrays.items():
+        if shared:
+            shared_memory = SharedMemory(name=array[0])
+            fold_data['shared_memory'].append(shared_memory)
+            array = np.ndarray(array[1], dtype=np.dtype(array[2]), buffer=shared_memory.buf)
+        fold_data[name] = array
+    if dataset is not None:
+        fold_data['dataset'] = load_dataset(dataset) if isinstance(dataset, str) else dataset
+
+def fit_booster(dataset, rows, model_params=MODEL_PARAMS, n_jobs=None):
+    # trains on a row subset of the binned dataset, reusing its bin mappers instead of binning the rows again
+    params = {**model_params, 'verbose': -1}
+    num_boost_round = params.pop('n_estimators', 100)
+    if n_jobs is not None:
+        params['num_threads'] = n_jobs
+    return lgb.train(params, dataset.subset(rows), num_boost_round=num_boost_round)
+
+def fit_fold(person_code, n_jobs=None, return_model=False, model_params=MODEL_PARAMS):
+    y = fold_data['y']
+    test_rows = fold_data['person_rows'][fold_data['person_bounds'][person_code]:fold_data['person_bounds'][person_code + 1]]
+    train_rows = np.flatnonzero(fold_data['person_codes'] != person_code)
+
+    model = fit_booster(fold_data['dataset'], train_rows, model_params, n_jobs)
+
+    # one prediction pass over X, the splits index into it rather than copying feature rows
+    y_prob = model.predict(fold_data['X'])
+
+    return {
+        'train': get_split_metrics(y[train_rows], y_prob[train_rows]),
+        'test': get_split_metrics(y[test_rows], y_prob[test_rows]),
+        'y_test': y[test_rows],
+        'y_test_prob': y_prob[test_rows],
+        'model': model if return_model else None,
+    }
 
-def train_model(labelled_epochs_power_bands_df, train_type):
-    start_time = time.time()
+def prepare_training_frame(labelled_epochs_power_bands_df, features=FEATURES):
     train_df = labelled_epochs_power_bands_df.copy(deep=True)
-    train_df['person'] = train_df['epochId'].apply(lambda x: x.split('-')[0][0] + x.split('-')[1])
+    train_df['person'] = get_person_column(train_df)
     train_df = train_df[~train_df['sleep_stage'].isin(['N', '?', 'M'])]
 
-    features = ['anterior_subdelta', 'anterior_delta', 'anterior_theta', 'anterior_alpha', 'anterior_beta', 'anterior_gamma', 
-                'posterior_subdelta', 'posterior_delta', 'posterior_theta', 'posterior_alpha', 'posterior_beta', 'posterior_gamma',
-                'anterior_delta_ratio', 'posterior_delta_ratio', 'anterior_theta_ratio', 'posterior_theta_ratio',
-                'anterior_alpha_ratio', 'posterior_alpha_ratio', 'anterior_beta_ratio', 'posterior_beta_ratio',
-                'anterior_gamma_ratio', 'posterior_gamma_ratio']
-    label = 'sleep_stage'
-
     scaler = MaxAbsScaler()
     train_df[features] = scaler.fit_transform(train_df[features])
 
-    model = LGBMClassifier(
-        boosting_type='gbdt',
-        num_leaves=131,
-        max_depth=-1,
-        learning_rate=0.1,
-        n_estimators=375,
-        objective='binary',
-        reg_alpha=0.9,
-        reg_lambda=0.1
-    )
+    return train_df, scaler
+
+def train_model(labelled_epochs_power_bands_df, train_type, cv_fraction=0.10, workers=1, model_params=MODEL_PARAMS, model_path=None, report_sinks=(print_report,)):
+    # report_sinks get the report dict described in training_report, e.g. print_report or a ReportWriter, nothing is plotted unless a sink asks
+    start_time = time.time()
+    features = FEATURES
+    label = LABEL
+
+    train_df, scaler = prepare_training_frame(labelled_epochs_power_bands_df, features)
 
     if train_type == 'rapid':
 
-        X = train_df[features]
-        y = train_df[label].apply(lambda x: 1 if x in ('1', '2') else 0)
-
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.20)
-
-        model.fit(X_train, y_train)
-
-        y_train_pred = model.predict(X_train)
-        y_test_pred = model.predict(X_test)
-        y_train_prob = model.predict_proba(X_train)[:, 1]
-        y_test_prob = model.predict_proba(X_test)[:, 1]
-
-        train_accuracy = accuracy_score(y_train, y_train_pred)
-        train_roc_auc = roc_auc_score(y_train, y_train_prob)
-        train_precision = precision_score(y_train, y_train_pred)
-        train_recall = recall_score(y_train, y_train_pred)
-        train_f1 = f1_score(y_train, y_train_pred)
-        train_log_loss = log_loss(y_train, y_train_prob)
-        train_conf_matrix = confusion_matrix(y_train, y_train_pred)
-        train_precision_lst, train_recall_lst, _ = precision_recall_curve(y_train, y_train_prob)
-        train_auc_pr = auc(train_recall_lst, train_precision_lst)
-        train_mcc = matthews_corrcoef(y_train, y_train_pred)
-
-        test_accuracy = accuracy_score(y_test, y_test_pred)
-        test_roc_auc = roc_auc_score(y_test, y_test_prob)
-        test_precision = precision_score(y_test, y_test_pred)
-        test_recall = recall_score(y_test, y_test_pred)
-        test_f1 = f1_score(y_test, y_test_pred)
-        test_log_loss = log_loss(y_test, y_test_prob)
-        test_conf_matrix = confusion_matrix(y_test, y_test_pred)
-        test_precision_lst, test_recall_lst, _ = precision_recall_curve(y_test, y_test_prob)
-        test_auc_pr = auc(test_recall_lst, test_precision_lst)
-        test_mcc = matthews_corrcoef(y_test, y_test_pred)
+        X = np.ascontiguousarray(train_df[features].to_numpy())
+        y = np.isin(train_df[label].to_numpy(dtype=str), ('1', '2')).astype(np.int64)
+
+        # binned once for all rows (or loaded from the dataset cache), the split is a pair of row subsets
+        dataset, _ = get_training_dataset(X, y, features, scaler)
+        train_rows, test_rows = train_test_split(np.arange(len(y)), test_size=0.20)
+
+        model = fit_booster(dataset, train_rows, model_params)
+
+        y_prob = model.predict(X)
+        y_test, y_test_prob = y[test_rows], y_prob[test_rows]
+        metrics = {'train': get_split_metrics(y[train_rows], y_prob[train_rows], pr_curve_order=True), 'test': get_split_metrics(y_test, y_test_prob, pr_curve_order=True)}
+        pooled_metrics = None
 
     elif train_type == 'cross_validation':
-        train_df = train_df.sample(frac=0.10, random_state=42) # 1.00 in production
-
-        # initialize lists to store metrics for each fold
-        train_metrics = {'accuracy': [], 'roc_auc': [], 'precision': [], 'recall': [], 'f1': [], 'log_loss': [], 'auc_pr': [], 'mcc': []}
-        test_metrics = {'accuracy': [], 'roc_auc': [], 'precision': [], 'recall': [], 'f1': [], 'log_loss': [], 'auc_pr': [], 'mcc': []}
-        train_conf_matrices = []
-        test_conf_matrices = []
-
-        # perform LOOCV variant
-        folds = 0
-        for person in tqdm(train_df['person'].unique()):
-            folds += 1
-            X_train = train_df[train_df['person'] != person][features]
-            y_train = train_df[train_df['person'] != person][label].apply(lambda x: 1 if x in ('1', '2') else 0)
-            X_test = train_df[train_df['person'] == person][features]
-            y_test = train_df[train_df['person'] == person][label].apply(lambda x: 1 if x in ('1', '2') else 0)
-
-            model.fit(X_train, y_train)
-
-            y_train_pred = model.predict(X_train)
-            y_test_pred = model.predict(X_test)
-            y_train_prob = model.predict_proba(X_train)[:, 1]
-            y_test_prob = model.predict_proba(X_test)[:, 1]
-
-            precision, recall, _ = precision_recall_curve(y_train, y_train_prob)
-            recall, precision = zip(*sorted(zip(recall, precision)))
-            train_metrics['auc_pr'].append(auc(recall, precision))
-
-            train_metrics['accuracy'].append(accuracy_score(y_train, y_train_pred))
-            train_metrics['roc_auc'].append(roc_auc_score(y_train, y_train_prob))
-            train_metrics['precision'].append(precision_score(y_train, y_train_pred))
-            train_metrics['recall'].append(recall_score(y_train, y_train_pred))
-            train_metrics['f1'].append(f1_score(y_train, y_train_pred))
-            train_metrics['log_loss'].append(log_loss(y_train, y_train_prob))
-            train_metrics['mcc'].append(matthews_corrcoef(y_train, y_train_pred))
-
-            precision, recall, _ = precision_recall_curve(y_test, y_test_prob)
-            recall, precision = zip(*sorted(zip(recall, precision)))
-            test_metrics['auc_pr'].append(auc(recall, precision))
-
-            test_metrics['accuracy'].append(accuracy_score(y_test, y_test_pred))
-            test_metrics['roc_auc'].append(roc_auc_score(y_test, y_test_prob))
-            test_metrics['precision'].append(precision_score(y_test, y_test_pred))
-            test_metrics['recall'].append(recall_score(y_test, y_test_pred))
-            test_metrics['f1'].append(f1_score(y_test, y_test_pred))
-            test_metrics['log_loss'].append(log_loss(y_test, y_test_prob))
-            test_metrics['mcc'].append(matthews_corrcoef(y_test, y_test_pred))
-
-            train_conf_matrices.append(confusion_matrix(y_train, y_train_pred))
-            test_conf_matrices.append(confusion_matrix(y_test, y_test_pred))
-
-        # Calculate average metrics
-        train_accuracy = sum(train_metrics['accuracy']) / folds
-        train_roc_auc = sum(train_metrics['roc_auc']) / folds
-        train_precision = sum(train_metrics['precision']) / folds
-        train_recall = sum(train_metrics['recall']) / folds
-        train_f1 = sum(train_metrics['f1']) / folds
-        train_log_loss = sum(train_metrics['log_loss']) / folds
-        train_auc_pr = sum(train_metrics['auc_pr']) / folds
-        train_mcc = sum(train_metrics['mcc']) / folds
-
-        test_accuracy = sum(test_metrics['accuracy']) / folds
-        test_roc_auc = sum(test_metrics['roc_auc']) / folds
-        test_precision = sum(test_metrics['precision']) / folds
-        test_recall = sum(test_metrics['recall']) / folds
-        test_f1 = sum(test_metrics['f1']) / folds
-        test_log_loss = sum(test_metrics['log_loss']) / folds
-        test_auc_pr = sum(test_metrics['auc_pr']) / folds
-        test_mcc = sum(test_metrics['mcc']) / folds
-
-        # Calculate average confusion matrices
-        train_conf_matrix = sum(train_conf_matrices)
-        test_conf_matrix = sum(test_conf_matrices)
-
-    print('-- TRAINING METRICS --')
-    print(f"Train Accuracy: {train_accuracy}")
-    print(f"Train ROC AUC: {train_roc_auc}")
-    print(f"Train Precision: {train_precision}")
-    print(f"Train Recall: {train_recall}")
-    print(f"Train F1-score: {train_f1}")
-    print(f"Train Log Loss: {train_log_loss}")
-    print(f"Train AUC-PR: {train_auc_pr}")
-    print(f"Train MCC: {train_mcc}")
-    print(f"Train Confusion Matrix:\n{train_conf_matrix}")
-
-    print('\n-- TESTING METRICS --')
-    print(f"Test Accuracy: {test_accuracy}")
-    print(f"Test ROC AUC: {test_roc_auc}")
-    print(f"Test Precision: {test_precision}")
-    print(f"Test Recall: {test_recall}")
-    print(f"Test F1-score: {test_f1}")
-    print(f"Test Log Loss: {test_log_loss}")
-    print(f"Test AUC-PR: {test_auc_pr}")
-    print(f"Test MCC: {test_mcc}")
-    print(f"Test Confusion Matrix:\n{test_conf_matrix}")
-
-    # Model performance summary metadata
-    print('\n -- MODEL PERFORMANCE SUMMARY --')
-    test_tp = test_conf_matrix[1][1]
-    test_tn = test_conf_matrix[0][0]
-    test_fp = test_conf_matrix[0][1]
-    test_fn = test_conf_matrix[1][0]
-    train_tp = train_conf_matrix[1][1]
-    train_tn = train_conf_matrix[0][0]
-    train_fp = train_conf_matrix[0][1]
-    train_fn = train_conf_matrix[1][0]
-    end_time = time.time()
-    training_time = end_time - start_time
-    print(f"{test_mcc}, {test_auc_pr}, {test_roc_auc}, {test_f1}, {test_precision}, {test_recall}, {test_log_loss}, {test_accuracy}, {test_tp}, {test_tn}, {test_fp}, {test_fn}, {train_mcc}, {train_auc_pr}, {train_roc_auc}, {train_f1}, {train_precision}, {train_recall}, {train_log_loss}, {train_accuracy}, {train_tp}, {train_tn}, {train_fp}, {train_fn}, {training_time}\n")
-
-    fpr, tpr, _ = roc_curve(y_test, y_test_prob)
-    precision, recall, _ = precision_recall_curve(y_test, y_test_prob)
-    auc_pr = auc(recall, precision)
-
-    fig, axes = plt.subplots(2, 2, figsize=(12, 8))
-
-    # ROC Curve
-    axes[0, 0].plot(fpr, tpr, color='darkorange', lw=2, label='ROC curve (AUC = %0.3f)' % test_roc_auc)
-    axes[0, 0].plot([0, 1], [0, 1], color='navy', lw=2, linestyle='--')
-    axes[0, 0].set_xlim([0.0, 1.0])
-    axes[0, 0].set_ylim([0.0, 1.05])
-    axes[0, 0].set_xlabel('False Positive Rate')
-    axes[0, 0].set_ylabel('True Positive Rate')
-    axes[0, 0].set_title('ROC Curve')
-    axes[0, 0].legend(loc="lower right")
-
-    # Precision-Recall Curve
-    axes[0, 1].plot(recall, precision, color='blue', lw=2, label='Precision-Recall Curve (AUC = %0.3f)' % auc_pr)
-    axes[0, 1].set_xlabel('Recall')
-    axes[0, 1].set_ylabel('Precision')
-    axes[0, 1].set_title('Precision-Recall Curve')
-    axes[0, 1].legend(loc="lower left")
-
-    # Confusion Matrix
-    sns.heatmap(test_conf_matrix, annot=True, fmt='d', cmap='Blues', xticklabels=['Other', 'N1/N2 Sleep'], yticklabels=['Other', 'N1/N2 Sleep'], ax=axes[1, 0], cbar=False)
-    axes[1, 0].set_xlabel('Predicted')
-    axes[1, 0].set_ylabel('Actual')
-    axes[1, 0].set_title('Confusion Matrix')
-
-    # Metrics Table
-    metrics_data = {
-        'Metric': ['MCC', 'AUC-PR', 'F1-Score', 'ROC AUC', 'Log Loss', 'Precision', 'Recall', 'Accuracy'],
-        'Testing': [round(test_mcc, 4), round(test_auc_pr, 4), round(test_f1, 4), round(test_roc_auc, 4), round(test_log_loss, 4), round(test_precision, 4), round(test_recall, 4), round(test_accuracy, 4)],
-        'Training': [round(train_mcc, 4), round(train_auc_pr, 4), round(train_f1, 4), round(train_roc_auc, 4), round(train_log_loss, 4), round(train_precision, 4), round(train_recall, 4), round(train_accuracy, 4)],
-        'GenRatio': [
-            round(test_mcc / train_mcc, 4) if train_mcc != 0 else 0,
-            round(test_auc_pr / train_auc_pr, 4) if train_auc_pr != 0 else 0,
-            round(test_f1 / train_f1, 4) if train_f1 != 0 else 0,
-            round(test_roc_auc / train_roc_auc, 4) if train_roc_auc != 0 else 0,
-            round(test_log_loss / train_log_loss, 4) if train_log_loss != 0 else 0,
-            round(test_precision / train_precision, 4) if train_precision != 0 else 0,
-            round(test_recall / train_recall, 4) if train_recall != 0 else 0,
-            round(test_accuracy / train_accuracy, 4) if train_accuracy != 0 else 0
-        ]
+        train_df = train_df.sample(frac=cv_fraction, random_state=42) # 1.00 in production
+
+        # perform LOOCV variant, folds run in a process pool with LightGBM threads split between workers
+        fold_arrays, people = build_fold_arrays(train_df, features, label)
+        dataset, dataset_path = get_training_dataset(fold_arrays['X'], fold_arrays['y'], features, scaler)
+        folds = len(people)
+        person_codes = range(folds)
+        return_models = [person_code == folds - 1 for person_code in person_codes]
+        if workers > 1:
+            threads_per_fold = max(1, (os.cpu_count() or 1) // workers)
+            shared_memory_blocks, shared_arrays = share_fold_arrays(fold_arrays)
+            try:
+                with ProcessPoolExecutor(max_workers=workers, initializer=init_fold_worker, initargs=(shared_arrays, True, dataset_path)) as executor:
+                    fold_results = list(tqdm(executor.map(fit_fold, person_codes, [threads_per_fold] * folds, return_models, [model_params] * folds), total=folds))
+            finally:
+                for shared_memory in shared_memory_blocks:
+                    shared_memory.close()
+                    shared_memory.unlink()
+        else:
+            init_fold_worker(fold_arrays, dataset=dataset)
+            fold_results = [fit_fold(person_code, return_model=return_model, model_params=model_params) for person_code, return_model in tqdm(zip(person_codes, return_models), total=folds)]
+            fold_data.clear()
+
+        # the report figure and the returned model come from the last fold, as when folds ran in sequence
+        model = fold_results[-1]['model']
+        y_test = fold_results[-1]['y_test']
+        y_test_prob = fold_results[-1]['y_test_prob']
+
+        # the reported metrics are averaged over folds (macro) with summed confusion matrices, the test folds together
+        # cover every row once, so their pooled (micro) metrics score all out-of-fold predictions as one set
+        metrics = {}
+        pooled_metrics = {}
+        metrics['train'], pooled_metrics['train'] = pool_fold_metrics([fold['train'] for fold in fold_results])
+        out_of_fold_y = np.concatenate([fold['y_test'] for fold in fold_results])
+        out_of_fold_prob = np.concatenate([fold['y_test_prob'] for fold in fold_results])
+        metrics['test'], pooled_metrics['test'] = pool_fold_metrics([fold['test'] for fold in fold_results], out_of_fold_y, out_of_fold_prob)
+
+    report = {
+        'train_type': train_type,
+        'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'training_time': time.time() - start_time,
+        'features': features,
+        'model_params': model_params,
+        'metrics': metrics,
+        'pooled_metrics': pooled_metrics,
+        'y_test': y_test,
+        'y_test_prob': y_test_prob,
     }
-    metrics_df = pd.DataFrame(metrics_data)
-    axes[1, 1].axis('tight')
-    axes[1, 1].axis('off')
-    table = axes[1, 1].table(cellText=metrics_df.values, colLabels=metrics_df.columns, cellLoc='center', loc='center', colColours=['#f2f2f2']*4)
-    table.auto_set_font_size(False)
-    table.set_fontsize(12)
-    table.scale(1.2, 1.2)
-    for (i, j), cell in table.get_celld().items():
-        cell.set_edgecolor('black')
-        if i == 0:
-            cell.set_text_props(weight='bold', color='white')
-            cell.set_facecolor('#40466e')
-        cell.set_height(0.1)
-    axes[1, 1].set_title('Metrics Summary')
-
-    plt.tight_layout(pad=3.0)
-    plt.show()
+    for report_sink in report_sinks:
+        report_sink(report)
+
+    if model_path is not None:
+        save_model(model, scaler, model_path, features)
+        export_model(model, scaler, features, os.path.splitext(model_path)[0] + '.npz')
 
     return model
\ No newline at end of file
@@ -0,0 +1,116 @@
+import os
+import time
+import numpy as np
+import pyarrow.parquet as pq
+from sklearn.preprocessing import MaxAbsScaler
+from table_storage import LABELLED_FEATURES_TABLE, DATA_TYPES
+from model_training import FEATURES, LABEL, MODEL_PARAMS, fit_booster, save_model
+from training_metrics import get_split_metrics, pool_fold_metrics
+from dataset_cache import get_training_dataset
+from compact_model import export_model
+from training_report import print_report
+
+EXCLUDED_STAGES = ['N', '?', 'M'] # unlabelled, unscored and movement epochs, as in prepare_training_frame
+POSITIVE_STAGES = ['1', '2'] # N1/N2 sleep
+
+def iter_table_batches(table_path, columns):
+    # NumPy columns of one parquet row group at a time (at most TABLE_ROW_GROUP_ROWS rows in tables from save_table), no pandas frame is ever built
+    parquet_file = pq.ParquetFile(f'{table_path}.parquet')
+    for row_group in range(parquet_file.num_row_groups):
+        batch = parquet_file.read_row_group(row_group, columns=columns)
+        yield {column: batch.column(column).to_numpy() for column in columns}
+
+def load_training_arrays(table_path=LABELLED_FEATURES_TABLE, features=FEATURES):
+    """Streams the labelled table into scaled float32 X, binary y and person codes, the arrays every fit shares."""
+    if not os.path.exists(f'{table_path}.parquet'):
+        raise FileNotFoundError(f'No parquet table at {table_path}.parquet, convert it with convert_csv_table first')
+
+    # first pass reads only the labels, so the arrays can be allocated at their final size
+    n_rows = sum(int(np.count_nonzero(~np.isin(batch[LABEL].astype(str), EXCLUDED_STAGES))) for batch in iter_table_batches(table_path, [LABEL]))
+    X = np.empty((n_rows, len(features)), dtype=np.float32)
+    y = np.empty(n_rows, dtype=np.int8)
+    person_ids = np.empty(n_rows, dtype=np.int32)
+    scaler = MaxAbsScaler()
+
+    start = 0
+    for batch in iter_table_batches(table_path, ['type', 'subject', LABEL] + features):
+        stages = batch[LABEL].astype(str)
+        keep = ~np.isin(stages, EXCLUDED_STAGES)
+        stop = start + np.count_nonzero(keep)
+
+        for column, feature in enumerate(features):
+            X[start:stop, column] = batch[feature][keep]
+        y[start:stop] = np.isin(stages[keep], POSITIVE_STAGES)
+        # one person per data type and subject, as get_person_column (DATA_TYPES is sorted)
+        person_ids[start:stop] = np.searchsorted(DATA_TYPES, batch['type'][keep].astype(str)) * 1000 + batch['subject'][keep]
+        scaler.partial_fit(X[start:stop])
+        start = stop
+
+    X /= scaler.scale_.astype(np.float32) # in place, MaxAbsScaler.transform would copy
+    people, person_codes = np.unique(person_ids, return_inverse=True)
+    people = [f'{DATA_TYPES[person_id // 1000][0]}{person_id % 1000:02d}' for person_id in people]
+
+    return {'X': X, 'y': y, 'person_codes': person_codes.astype(np.int32), 'people': people, 'scaler': scaler, 'features': list(features)}
+
+def evaluate_booster(booster, training_arrays, train_rows, test_rows, out_of_fold_prob=None):
+    # one prediction pass over X, the splits index into it rather than copying feature rows
+    y = training_arrays['y']
+    y_prob = booster.predict(training_arrays['X'])
+    if out_of_fold_prob is not None:
+        out_of_fold_prob[test_rows] = y_prob[test_rows]
+    return {split: get_split_metrics(y[rows], y_prob[rows]) for split, rows in (('train', train_rows), ('test', test_rows))}
+
+def train_model_out_of_core(train_type, table_path=LABELLED_FEATURES_TABLE, test_size=0.20, cv_fraction=1.00, model_params=MODEL_PARAMS, n_jobs=None, model_path=None, seed=42, report_sinks=(print_report,)):
+    """Low-memory counterpart of train_model, reading the labelled table from disk instead of a DataFrame."""
+    start_time = time.time()
+    training_arrays = load_training_arrays(table_path)
+    # binned once for all rows and kept in the dataset cache, fits take row subsets that share its bin mappers
+    dataset, _ = get_training_dataset(training_arrays['X'], training_arrays['y'], training_arrays['features'], training_arrays['scaler'])
+    rng = np.random.default_rng(seed)
+    n_rows = len(training_arrays['y'])
+    out_of_fold_prob = np.empty(n_rows)
+
+    if train_type == 'rapid':
+        is_test = np.zeros(n_rows, dtype=bool)
+        is_test[rng.choice(n_rows, int(np.ceil(n_rows * test_size)), replace=False)] = True
+        train_rows = np.flatnonzero(~is_test)
+        test_rows = np.flatnonzero(is_test)
+        booster = fit_booster(dataset, train_rows, model_params, n_jobs)
+        metrics = evaluate_booster(booster, training_arrays, train_rows, test_rows, out_of_fold_prob)
+        pooled_metrics = None
+
+    elif train_type == 'cross_validation':
+        rows = np.sort(rng.choice(n_rows, int(round(n_rows * cv_fraction)), replace=False))
+        person_codes = training_arrays['person_codes'][rows]
+        fold_metrics = []
+        for person_code in np.unique(person_codes):
+            train_rows = rows[person_codes != person_code]
+            booster = fit_booster(dataset, train_rows, model_params, n_jobs)
+            fold_metrics.append(evaluate_booster(booster, training_arrays, train_rows, rows[person_codes == person_code], out_of_fold_prob))
+
+        # averaged over folds with summed confusion matrices as train_model reports them, pooled over all out-of-fold predictions in pooled_metrics
+        metrics = {}
+        pooled_metrics = {}
+        metrics['train'], pooled_metrics['train'] = pool_fold_metrics([fold['train'] for fold in fold_metrics])
+        metrics['test'], pooled_metrics['test'] = pool_fold_metrics([fold['test'] for fold in fold_metrics], training_arrays['y'][rows], out_of_fold_prob[rows])
+        test_rows = rows # the figure's curves are drawn over every out-of-fold prediction
+
+    report = {
+        'train_type': train_type,
+        'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'training_time': time.time() - start_time,
+        'features': training_arrays['features'],
+        'model_params': model_params,
+        'metrics': metrics,
+        'pooled_metrics': pooled_metrics,
+        'y_test': training_arrays['y'][test_rows],
+        'y_test_prob': out_of_fold_prob[test_rows],
+    }
+    for report_sink in report_sinks:
+        report_sink(report)
+
+    if model_path is not None:
+        save_model(booster, training_arrays['scaler'], model_path, training_arrays['features'])
+        export_model(booster, training_arrays['scaler'], training_arrays['features'], os.path.splitext(model_path)[0] + '.npz')
+
+    return booster
@@ -3,23 +3,14 @@ import mne
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from band_power import EPOCH_LENGTH, POWER_BANDS, compute_power_bands, get_band_slices, compute_power_bands_batch
+from table_storage import FEATURES_TABLE, LABELLED_FEATURES_TABLE, save_table, load_table, convert_csv_table
+from raw_signal_store import RAW_STORE_DIR, get_night_key, load_raw_store_index, append_raw_store_nights, read_raw_store_night
+from feature_cache import FEATURE_CACHE_MAX_BYTES, get_cache_key, load_cached_features, save_cached_features, evict_feature_cache, clear_feature_cache
 
-def compute_power_bands(signal, sampling_frequency):
-    freqs = np.fft.rfftfreq(len(signal), d=1/sampling_frequency)
-    fft_vals = np.abs(np.fft.rfft(signal))**2
-
-    total_power = np.sum(fft_vals)
-    power_bands = {
-        'subdelta': np.sum(fft_vals[freqs < 0.5]),
-        'delta': np.sum(fft_vals[(freqs >= 0.5) & (freqs < 4)]),
-        'theta': np.sum(fft_vals[(freqs >= 4) & (freqs < 8)]),
-        'alpha': np.sum(fft_vals[(freqs >= 8) & (freqs < 12)]),
-        'beta': np.sum(fft_vals[(freqs >= 12) & (freqs < 30)]),
-        'gamma': np.sum(fft_vals[(freqs >= 30)]),
-    }
-    power_ratios = {band: round(power / total_power, 5) for band, power in power_bands.items()}
-    
-    return power_bands, power_ratios
+EEG_CHANNELS = ['EEG Fpz-Cz', 'EEG Pz-Oz'] # anterior, posterior
 
 def load_edf_files(edf_files):
     for edf_file in edf_files:
@@ -27,88 +18,194 @@ def load_edf_files(edf_files):
             continue
         yield edf_file
 
-def process_edf_file(edf_file):
+def get_edf_path(edf_file):
     if edf_file[1] == 'T':
-        raw = mne.io.read_raw_edf(os.path.join('data', 'physionet', 'sleep-telemetry', edf_file), preload=True, verbose=False)
-        data_type = 'telemetry'
+        return os.path.join('data', 'physionet', 'sleep-telemetry', edf_file), 'telemetry'
     elif edf_file[1] == 'C':
-        raw = mne.io.read_raw_edf(os.path.join('data', 'physionet', 'sleep-cassette', edf_file), preload=True, verbose=False)
-        data_type = 'cassette'
+        return os.path.join('data', 'physionet', 'sleep-cassette', edf_file), 'cassette'
     else:
         raise ValueError('Invalid file name')
-    
+
+def make_epoch_ids(data_type, subject_number, night_number, n_epochs):
+    return [f"{data_type}-{subject_number}-{night_number}-{epoch:04d}" for epoch in range(n_epochs)]
+
+def read_edf_signals(edf_file, chunk_seconds=3600):
+    edf_path, data_type = get_edf_path(edf_file)
+    raw = mne.io.read_raw_edf(edf_path, include=EEG_CHANNELS, preload=False, verbose=False)
+
     sampling_frequency = raw.info['sfreq']
     subject_number = edf_file[3:5]
     night_number = edf_file[5]
-    
-    df = raw.to_data_frame()
-    df = df[['time', 'EEG Fpz-Cz', 'EEG Pz-Oz']]
-    df.columns = ['time', 'eegAnterior', 'eegPosterior']
+
+    # decode straight into float32 in chunks so the whole night is never held as float64
+    signals = np.empty((len(EEG_CHANNELS), raw.n_times), dtype=np.float32)
+    chunk_size = int(chunk_seconds * sampling_frequency)
+    for start in range(0, raw.n_times, chunk_size):
+        stop = min(start + chunk_size, raw.n_times)
+        signals[:, start:stop] = raw.get_data(picks=EEG_CHANNELS, start=start, stop=stop, units='uV')
+
+    return signals, sampling_frequency, data_type, subject_number, night_number
+
+def load_night_signals(edf_file, raw_store_dir=None):
+    # same return as read_edf_signals, served from the memory-mapped store when one is given
+    if raw_store_dir is None:
+        return read_edf_signals(edf_file)
+
+    data_type = get_edf_path(edf_file)[1]
+    subject_number = edf_file[3:5]
+    night_number = edf_file[5]
+    signals, sampling_frequency = read_raw_store_night(get_night_key(data_type, subject_number, night_number), raw_store_dir)
+
+    return signals, sampling_frequency, data_type, subject_number, night_number
+
+def build_raw_store(raw_store_dir=RAW_STORE_DIR):
+    # one-time EDF decode of every night into the raw store, nights already stored are skipped
+    edf_files = list_night_files(hypnogram=False)
+    stored_nights = load_raw_store_index(raw_store_dir)
+
+    def decode_nights():
+        for edf_file in tqdm(edf_files, desc='Building Raw Store', colour='GREEN'):
+            data_type = get_edf_path(edf_file)[1]
+            night_key = get_night_key(data_type, edf_file[3:5], edf_file[5])
+            if night_key in stored_nights:
+                continue
+            signals, sampling_frequency, *_ = read_edf_signals(edf_file)
+            yield night_key, signals, sampling_frequency
+
+    return append_raw_store_nights(decode_nights(), raw_store_dir)
+
+def process_edf_file(edf_file):
+    signals, sampling_frequency, data_type, subject_number, night_number = read_edf_signals(edf_file)
+    samples_per_epoch = int(round(sampling_frequency * EPOCH_LENGTH))
+    epoch_num = np.arange(signals.shape[1]) // samples_per_epoch # new epoch assigned for every 30 seconds
+    epoch_ids = np.array(make_epoch_ids(data_type, subject_number, night_number, int(epoch_num[-1]) + 1))
+
+    df = pd.DataFrame({
+        'time': np.arange(signals.shape[1]) / sampling_frequency,
+        'eegAnterior': signals[0],
+        'eegPosterior': signals[1],
+    })
     df['type'] = data_type
     df['subject'] = subject_number
     df['night'] = night_number
-    df['epochNum'] = ((df['time'] - df['time'][0]) // 30).astype(int) # new epoch assigned for every 30 seconds
-    df['epochId'] = data_type + '-' + subject_number + '-' + night_number + '-' + df['epochNum'].apply(lambda x: f"{x:04d}")
+    df['epochNum'] = epoch_num
+    df['epochId'] = epoch_ids[epoch_num]
 
     return df, sampling_frequency
 
+def compute_power_bands_for_night(edf_file, use_cache=False, raw_store_dir=None):
+    if use_cache:
+        # keyed on the recording's content plus everything that shapes the features
+        cache_key = get_cache_key(get_edf_path(edf_file)[0], edf_file=edf_file, bands=POWER_BANDS, epoch_length=EPOCH_LENGTH, channels=EEG_CHANNELS)
+        power_bands_df = load_cached_features(cache_key)
+        if power_bands_df is not None:
+            return power_bands_df
+
+    signals, sampling_frequency, data_type, subject_number, night_number = load_night_signals(edf_file, raw_store_dir)
+    samples_per_epoch = int(round(sampling_frequency * EPOCH_LENGTH))
+    n_epochs = -(-signals.shape[1] // samples_per_epoch)
+    epoch_ids = make_epoch_ids(data_type, subject_number, night_number, n_epochs)
+    power_bands_df = compute_power_bands_for_signals(signals[0], signals[1], sampling_frequency, epoch_ids)
+
+    if use_cache:
+        save_cached_features(cache_key, power_bands_df)
+
+    return power_bands_df
+
+def compute_power_bands_for_signals(eeg_anterior, eeg_posterior, sampling_frequency, epoch_ids):
+    samples_per_epoch = int(round(sampling_frequency * EPOCH_LENGTH))
+    n_full_epochs = min(len(eeg_anterior) // samples_per_epoch, len(epoch_ids))
+    n_samples = n_full_epochs * samples_per_epoch
+
+    features = {'epochId': list(epoch_ids[:n_full_epochs])}
+    for channel, signal in (('anterior', eeg_anterior), ('posterior', eeg_posterior)):
+        features[channel] = compute_power_bands_batch(np.reshape(signal[:n_samples], (n_full_epochs, samples_per_epoch)), sampling_frequency)
+
+    # trailing partial epoch (if any) has its own frequency grid
+    if len(epoch_ids) > n_full_epochs and len(eeg_anterior) > n_samples:
+        features['epochId'].append(epoch_ids[n_full_epochs])
+        for channel, signal in (('anterior', eeg_anterior), ('posterior', eeg_posterior)):
+            partial_bands, partial_ratios = compute_power_bands_batch(signal[None, n_samples:], sampling_frequency)
+            features[channel] = (np.vstack([features[channel][0], partial_bands]), np.vstack([features[channel][1], partial_ratios]))
+
+    power_bands_df = pd.DataFrame({'epochId': features['epochId']})
+    for channel in ('anterior', 'posterior'):
+        for i, band in enumerate(POWER_BANDS):
+            power_bands_df[f'{channel}_{band}'] = features[channel][0][:, i]
+    for channel in ('anterior', 'posterior'):
+        for i, band in enumerate(POWER_BANDS):
+            power_bands_df[f'{channel}_{band}_ratio'] = features[channel][1][:, i]
+
+    return power_bands_df
+
 def compute_power_bands_for_epochs(df, sampling_frequency):
-    epochs = df.groupby('epochId')
-    power_bands_list = []
+    epoch_starts = np.flatnonzero(np.diff(df['epochNum'].values, prepend=-1))
+    epoch_ids = df['epochId'].values[epoch_starts]
 
-    for epoch_id, epoch_df in epochs:
-        eeg_anterior = epoch_df['eegAnterior'].values
-        eeg_posterior = epoch_df['eegPosterior'].values
+    return compute_power_bands_for_signals(df['eegAnterior'].values, df['eegPosterior'].values, sampling_frequency, epoch_ids)
 
-        power_bands_anterior, ratios_anterior = compute_power_bands(eeg_anterior, sampling_frequency)
-        power_bands_posterior, ratios_posterior = compute_power_bands(eeg_posterior, sampling_frequency)
+def list_night_files(hypnogram):
+    night_files = []
+    night_files.extend(os.listdir(os.path.join('data', 'physionet', 'sleep-cassette')))
+    night_files.extend(os.listdir(os.path.join('data', 'physionet', 'sleep-telemetry')))
+    return sorted(night_file for night_file in night_files if ('Hypnogram' in night_file) == hypnogram)
 
-        power_bands = {
-            'epochId': epoch_id,
-            **{f'anterior_{band}': power for band, power in power_bands_anterior.items()},
-            **{f'posterior_{band}': power for band, power in power_bands_posterior.items()},
-            **{f'anterior_{band}_ratio': ratio for band, ratio in ratios_anterior.items()},
-            **{f'posterior_{band}_ratio': ratio for band, ratio in ratios_posterior.items()}
-        }
-        power_bands_list.append(power_bands)
+def run_night(night_function, night_file):
+    return os.getpid(), night_function(night_file)
 
-    return pd.DataFrame(power_bands_list)
+def map_nights(night_function, night_files, workers=1, desc='Processing Nights'):
+    # results come back in the order of night_files, failed nights are reported and left as None
+    results = [None] * len(night_files)
+    failures = []
 
-def preprocess_features(preprocess_features, download_files):
+    if workers <= 1:
+        for i, night_file in enumerate(tqdm(night_files, desc=desc, colour='GREEN')):
+            try:
+                results[i] = night_function(night_file)
+            except Exception as e:
+                failures.append((night_file, e))
+    else:
+        nights_per_worker = {}
+        with ProcessPoolExecutor(max_workers=workers) as executor, tqdm(total=len(night_files), desc=desc, colour='GREEN') as progress:
+            futures = {executor.submit(run_night, night_function, night_file): i for i, night_file in enumerate(night_files)}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    pid, results[i] = future.result()
+                    nights_per_worker[pid] = nights_per_worker.get(pid, 0) + 1
+                except Exception as e:
+                    failures.append((night_files[i], e))
+                progress.set_postfix(workers=len(nights_per_worker), per_worker=f"{min(nights_per_worker.values(), default=0)}-{max(nights_per_worker.values(), default=0)}", failed=len(failures))
+                progress.update(1)
 
-    if preprocess_features:
-        edf_files = []
-        edf_files.extend(os.listdir(os.path.join('data', 'physionet', 'sleep-cassette')))
-        edf_files.extend(os.listdir(os.path.join('data', 'physionet', 'sleep-telemetry')))
-        edf_files = [edf_file for edf_file in edf_files if 'Hypnogram' not in edf_file]
-        all_epochs_power_bands_df = []
+    for night_file, e in failures:
+        print(f"Failed to process {night_file}: {type(e).__name__}: {e}")
+
+    return results
 
-        for edf_file in tqdm(edf_files, desc='Processing Nights (Features)', colour='GREEN'):
-            raw_data_df, sampling_freq = process_edf_file(edf_file)
-            epochs_power_bands_df = compute_power_bands_for_epochs(raw_data_df, sampling_freq)
-            all_epochs_power_bands_df.append(epochs_power_bands_df)
+def preprocess_features(preprocess_features, download_files, workers=1, use_cache=True, cache_max_bytes=FEATURE_CACHE_MAX_BYTES, raw_store_dir=None, columns=None):
 
-        all_epochs_power_bands_df = pd.concat(all_epochs_power_bands_df, ignore_index=True)
+    if preprocess_features:
+        edf_files = list_night_files(hypnogram=False)
+        all_epochs_power_bands_df = map_nights(partial(compute_power_bands_for_night, use_cache=use_cache, raw_store_dir=raw_store_dir), edf_files, workers=workers, desc='Processing Nights (Features)')
+        all_epochs_power_bands_df = pd.concat([df for df in all_epochs_power_bands_df if df is not None], ignore_index=True)
+
+        if use_cache:
+            evict_feature_cache(cache_max_bytes)
 
         if download_files:
-            all_epochs_power_bands_df.to_csv(os.path.join('data', 'physionet', 'frequency_spectrum_data.csv'), index=False)
-            print('Data saved to data/physionet/frequency_spectrum_data.csv')
-            print(f"File Size: {all_epochs_power_bands_df.memory_usage(deep=True).sum() / 1e6:.2f} MB")
+            table_file = save_table(all_epochs_power_bands_df, FEATURES_TABLE)
+            print(f'Data saved to {table_file}')
+            print(f"File Size: {os.path.getsize(table_file) / 1e6:.2f} MB")
 
     else:
-        all_epochs_power_bands_df = pd.read_csv(os.path.join('data', 'physionet', 'frequency_spectrum_data.csv'))
+        all_epochs_power_bands_df = load_table(FEATURES_TABLE, columns=columns)
 
     return all_epochs_power_bands_df
 
 def extract_annotations(edfp_file):
-    if edfp_file[1] == 'T':
-        raw = mne.read_annotations(os.path.join('data', 'physionet', 'sleep-telemetry', edfp_file))
-        data_type = 'telemetry'
-    elif edfp_file[1] == 'C':
-        raw = mne.read_annotations(os.path.join('data', 'physionet', 'sleep-cassette', edfp_file))
-        data_type = 'cassette'
-    else:
-        raise ValueError('Invalid file name')
+    edfp_path, data_type = get_edf_path(edfp_file)
+    raw = mne.read_annotations(edfp_path)
 
     annotations_df = pd.DataFrame({
         "onset": raw.onset,
@@ -116,61 +213,65 @@ def extract_annotations(edfp_file):
         "end": raw.onset + raw.duration,
         "sleep_stage": raw.description
     })
-    annotations_df['sleep_stage'] = annotations_df['sleep_stage'].apply(lambda x: 'M' if x == 'Movement time' else x.split(' ')[-1])
-    
+    annotations_df['sleep_stage'] = np.where(annotations_df['sleep_stage'] == 'Movement time', 'M', annotations_df['sleep_stage'].str.split(' ').str[-1])
+
     subject_number = edfp_file[3:5]
     night_number = edfp_file[5]
-    annotations_df['epochId'] = annotations_df.apply(lambda row: f"{data_type}-{subject_number}-{night_number}-{int(row['onset'] // 30):04d}", axis=1)
-    
+    annotations_df['epochId'] = f"{data_type}-{subject_number}-{night_number}-" + (annotations_df['onset'] // EPOCH_LENGTH).astype(int).map('{:04d}'.format)
+
     return annotations_df, data_type, subject_number, night_number
 
 def generate_labels(annotations_df, data_type, subject_number, night_number):
-    labels_list = []
-    epochs = int((annotations_df.iloc[-1]['onset'] + annotations_df.iloc[-1]['duration']) // 30)
-
-    for epoch in range(epochs):
-        min_timestamp = epoch * 30
-        max_timestamp = (epoch + 1) * 30
-        epoch_id = f"{data_type}-{subject_number}-{night_number}-{epoch:04d}"
-        interval_epoch_annotations = annotations_df[(annotations_df['onset'] < max_timestamp) & (annotations_df['end'] > min_timestamp)]
-        if len(interval_epoch_annotations) == 0:
-            sleep_stage = 'N' # no label available
-        elif len(interval_epoch_annotations) == 1:
-            sleep_stage = interval_epoch_annotations.iloc[0]['sleep_stage']
-        else:
-            sleep_stage = 'T' # transition epoch
-        labels_list.append({
-            'epochId': epoch_id,
-            'sleep_stage': sleep_stage
-        })
-
-    return labels_list
-
-def preprocess_labels(all_epochs_power_bands_df, preprocess_labels, download_files):
-
-    labelled_epochs_power_bands_df = all_epochs_power_bands_df.copy(deep=True)
+    epochs = int((annotations_df.iloc[-1]['onset'] + annotations_df.iloc[-1]['duration']) // EPOCH_LENGTH)
+    epoch_starts = np.arange(epochs) * EPOCH_LENGTH
+    epoch_ends = epoch_starts + EPOCH_LENGTH
+
+    order = np.argsort(annotations_df['onset'].values, kind='stable')
+    onsets = annotations_df['onset'].values[order]
+    ends = annotations_df['end'].values[order]
+    stages = annotations_df['sleep_stage'].values[order]
+
+    # annotations overlapping an epoch = those starting before it ends minus those ending before it starts
+    started = np.searchsorted(onsets, epoch_ends, side='left')
+    finished = np.searchsorted(np.sort(ends), epoch_starts, side='right')
+    overlaps = started - finished
+
+    sleep_stages = np.full(epochs, 'N', dtype=object) # no label available
+    sleep_stages[overlaps > 1] = 'T' # transition epoch
+
+    # with a single overlap it is normally the latest annotation to start, otherwise fall back to a scan
+    single = np.flatnonzero(overlaps == 1)
+    candidates = started[single] - 1
+    matched = ends[candidates] > epoch_starts[single]
+    sleep_stages[single[matched]] = stages[candidates[matched]]
+    for epoch in single[~matched]:
+        sleep_stages[epoch] = stages[(onsets < epoch_ends[epoch]) & (ends > epoch_starts[epoch])][0]
+
+    return pd.DataFrame({
+        'epochId': make_epoch_ids(data_type, subject_number, night_number, epochs),
+        'sleep_stage': sleep_stages
+    })
+
+def label_night(edfp_file):
+    annotations_df, data_type, subject_number, night_number = extract_annotations(edfp_file)
+    return generate_labels(annotations_df, data_type, subject_number, night_number)
+
+def preprocess_labels(all_epochs_power_bands_df, preprocess_labels, download_files, workers=1, columns=None):
+    # all_epochs_power_bands_df is only used when labels are regenerated, pass None to load the labelled table from disk
 
     if preprocess_labels:
-        edfp_files = []
-        edfp_files.extend(os.listdir(os.path.join('data', 'physionet', 'sleep-cassette')))
-        edfp_files.extend(os.listdir(os.path.join('data', 'physionet', 'sleep-telemetry')))
-        edfp_files = [edf_file for edf_file in edfp_files if 'Hypnogram' in edf_file]
-
-        labels_list = []
-        for edfp_file in tqdm(edfp_files, desc='Processing Nights (Labels)', colour='GREEN'):
-            annotations_df, data_type, subject_number, night_number = extract_annotations(edfp_file)
-            labels_list.extend(generate_labels(annotations_df, data_type, subject_number, night_number))
-
-        labels_df = pd.DataFrame(labels_list)
-        labelled_epochs_power_bands_df = labelled_epochs_power_bands_df.merge(labels_df, on='epochId', how='left')
+        edfp_files = list_night_files(hypnogram=True)
+        labels_df = map_nights(label_night, edfp_files, workers=workers, desc='Processing Nights (Labels)')
+        labels_df = pd.concat([df for df in labels_df if df is not None], ignore_index=True)
+        labelled_epochs_power_bands_df = all_epochs_power_bands_df.merge(labels_df, on='epochId', how='left')
         labelled_epochs_power_bands_df['sleep_stage'] = labelled_epochs_power_bands_df['sleep_stage'].fillna('N')
 
     else:
-        labelled_epochs_power_bands_df = pd.read_csv(os.path.join('data', 'physionet', 'labelled_frequency_spectrum_data.csv'))
+        labelled_epochs_power_bands_df = load_table(LABELLED_FEATURES_TABLE, columns=columns)
 
     # Save the merged dataframe if needed
     if download_files:
-        labelled_epochs_power_bands_df.to_csv(os.path.join('data', 'physionet', 'labelled_frequency_spectrum_data.csv'), index=False)
-        print('Data with labels saved to data/physionet/labelled_frequency_spectrum_data.csv')
+        table_file = save_table(labelled_epochs_power_bands_df, LABELLED_FEATURES_TABLE)
+        print(f'Data with labels saved to {table_file}')
 
     return labelled_epochs_power_bands_df
\ No newline at end of file
@@ -0,0 +1,64 @@
+import os
+import json
+import numpy as np
+
+RAW_STORE_DIR = os.path.join('data', 'physionet', 'raw_store')
+RAW_STORE_DTYPE = np.float32
+
+open_raw_stores = {}
+
+def get_night_key(data_type, subject_number, night_number):
+    return f"{data_type}-{subject_number}-{night_number}"
+
+def load_raw_store_index(store_dir=RAW_STORE_DIR):
+    index_path = os.path.join(store_dir, 'index.json')
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path) as index_file:
+        return json.load(index_file)
+
+def save_raw_store_index(index, store_dir=RAW_STORE_DIR):
+    index_path = os.path.join(store_dir, 'index.json')
+    with open(f'{index_path}.tmp', 'w') as index_file:
+        json.dump(index, index_file, indent=1)
+    os.replace(f'{index_path}.tmp', index_path)
+
+def get_raw_store_end(index):
+    # first element past the last indexed night, anything after it is a partial write
+    return max((night['offset'] + night['channels'] * night['length'] for night in index.values()), default=0)
+
+def append_raw_store_nights(nights, store_dir=RAW_STORE_DIR):
+    # nights yields (night_key, signals, sampling_frequency) with signals shaped (channels, n_samples)
+    os.makedirs(store_dir, exist_ok=True)
+    signals_path = os.path.join(store_dir, 'signals.f32')
+    index = load_raw_store_index(store_dir)
+    itemsize = np.dtype(RAW_STORE_DTYPE).itemsize
+
+    with open(signals_path, 'ab') as signals_file:
+        signals_file.truncate(get_raw_store_end(index) * itemsize)
+        signals_file.seek(0, os.SEEK_END)
+
+        for night_key, signals, sampling_frequency in nights:
+            offset = signals_file.tell() // itemsize
+            np.ascontiguousarray(signals, dtype=RAW_STORE_DTYPE).tofile(signals_file)
+            signals_file.flush()
+            index[night_key] = {'offset': offset, 'channels': signals.shape[0], 'length': signals.shape[1], 'sfreq': sampling_frequency}
+            save_raw_store_index(index, store_dir) # saved per night so an interrupted build can resume
+
+    open_raw_stores.pop(store_dir, None)
+    return index
+
+def open_raw_store(store_dir=RAW_STORE_DIR):
+    # one read-only memmap per process, night slices are views into the page cache
+    if store_dir not in open_raw_stores:
+        index = load_raw_store_index(store_dir)
+        signals = np.memmap(os.path.join(store_dir, 'signals.f32'), dtype=RAW_STORE_DTYPE, mode='r', shape=(get_raw_store_end(index),))
+        open_raw_stores[store_dir] = {'signals': signals, 'index': index}
+    return open_raw_stores[store_dir]
+
+def read_raw_store_night(night_key, store_dir=RAW_STORE_DIR):
+    raw_store = open_raw_store(store_dir)
+    night = raw_store['index'][night_key]
+    start = night['offset']
+    stop = start + night['channels'] * night['length']
+    return raw_store['signals'][start:stop].reshape(night['channels'], night['length']), night['sfreq']
@@ -0,0 +1,92 @@
+import numpy as np
+from band_power import SlidingBandPower, compute_power_bands_batch, get_feature_index, resample_signals
+from model_training import MODEL_PATH, load_model_bundle
+
+class StreamingSleepStager:
+    """Scores a live EEG stream with a saved model every hop over a sliding window of one training epoch."""
+
+    def __init__(self, model_path=MODEL_PATH, sampling_frequency=256, hop_seconds=5, channels=('anterior', 'posterior'), incremental=False):
+        model_bundle = load_model_bundle(model_path)
+        self.model = model_bundle['model']
+        self.booster = getattr(self.model, 'booster_', self.model) # out-of-core training saves a bare Booster
+        self.scale = np.asarray(model_bundle['scaler'].scale_, dtype=np.float64)
+        self.feature_index = get_feature_index(model_bundle['features'], channels)
+
+        # windows are resampled to the model's rate, so the bands and their powers match the training epochs
+        self.sampling_frequency = sampling_frequency
+        self.model_sampling_frequency = model_bundle['sampling_frequency']
+        self.window_size = int(round(model_bundle['epoch_length'] * sampling_frequency))
+        self.hop_size = int(round(hop_seconds * sampling_frequency))
+        if not 0 < self.hop_size <= self.window_size:
+            raise ValueError('hop_seconds must be positive and no longer than the model\'s epoch length')
+        epoch_size = int(round(model_bundle['epoch_length'] * self.model_sampling_frequency))
+        if resample_signals(np.zeros(self.window_size), sampling_frequency, self.model_sampling_frequency).shape[-1] != epoch_size:
+            raise ValueError(f'{sampling_frequency} Hz windows do not resample to the model\'s {epoch_size}-sample epochs at {self.model_sampling_frequency} Hz')
+        if incremental and sampling_frequency != self.model_sampling_frequency:
+            raise ValueError(f'incremental band powers need the stream at the model\'s {self.model_sampling_frequency} Hz, not {sampling_frequency} Hz')
+
+        # every sample is written twice, window_size apart, so the current window is always one contiguous slice
+        self.ring_buffer = np.zeros((len(channels), 2 * self.window_size), dtype=np.float64)
+        self.position = 0
+        self.samples_seen = 0
+        self.samples_to_next_hop = self.hop_size
+
+        # sliding DFT keeps short hops cheap, the ring buffer is still kept for window()
+        self.sliding_band_power = SlidingBandPower(self.window_size, sampling_frequency, len(channels)) if incremental else None
+
+    def reset(self):
+        self.ring_buffer[:] = 0
+        self.position = 0
+        self.samples_seen = 0
+        self.samples_to_next_hop = self.hop_size
+        if self.sliding_band_power is not None:
+            self.sliding_band_power = SlidingBandPower(self.window_size, self.sampling_frequency, self.ring_buffer.shape[0])
+
+    def window(self):
+        return self.ring_buffer[:, self.position:self.position + self.window_size]
+
+    def write(self, chunk):
+        # chunk is never longer than a hop, so it wraps the ring at most once
+        n_samples = chunk.shape[1]
+        first = min(n_samples, self.window_size - self.position)
+        for offset in (self.position, self.position + self.window_size):
+            self.ring_buffer[:, offset:offset + first] = chunk[:, :first]
+        if n_samples > first:
+            for offset in (0, self.window_size):
+                self.ring_buffer[:, offset:offset + n_samples - first] = chunk[:, first:]
+        self.position = (self.position + n_samples) % self.window_size
+        if self.sliding_band_power is not None:
+            self.sliding_band_power.update(chunk)
+
+    def compute_features(self):
+        if self.sliding_band_power is not None:
+            power_bands, power_ratios = self.sliding_band_power.power_bands()
+        else:
+            window = resample_signals(self.window(), self.sampling_frequency, self.model_sampling_frequency)
+            power_bands, power_ratios = compute_power_bands_batch(window, self.model_sampling_frequency)
+        return np.concatenate([power_bands.ravel(), power_ratios.ravel()])[self.feature_index]
+
+    def score(self):
+        features = self.compute_features()
+        probability = self.booster.predict((features / self.scale)[None, :])[0]
+        return {'sample': self.samples_seen, 'features': features, 'probability': probability}
+
+    def push(self, samples):
+        """Adds (n_channels, n_samples) new samples and returns the scores of every hop they complete."""
+        samples = np.asarray(samples, dtype=np.float64).reshape(self.ring_buffer.shape[0], -1)
+        scores = []
+
+        start = 0
+        while start < samples.shape[1]:
+            stop = start + min(samples.shape[1] - start, self.samples_to_next_hop)
+            self.write(samples[:, start:stop])
+            self.samples_seen += stop - start
+            self.samples_to_next_hop -= stop - start
+            start = stop
+
+            if self.samples_to_next_hop == 0:
+                self.samples_to_next_hop = self.hop_size
+                if self.samples_seen >= self.window_size:
+                    scores.append(self.score())
+
+        return scores
@@ -0,0 +1,64 @@
+import os
+import numpy as np
+import pandas as pd
+
+FEATURES_TABLE = os.path.join('data', 'physionet', 'frequency_spectrum_data')
+LABELLED_FEATURES_TABLE = os.path.join('data', 'physionet', 'labelled_frequency_spectrum_data')
+ID_COLUMNS = ['type', 'subject', 'night', 'epochNum']
+DATA_TYPES = ['cassette', 'telemetry']
+SLEEP_STAGES = ['W', '1', '2', '3', '4', 'R', 'M', '?', 'T', 'N']
+TABLE_ROW_GROUP_ROWS = 65536 # bounds what a streaming reader decodes at once
+
+def to_storage_frame(df):
+    # epochId is split into compact id columns, features are stored as float32
+    id_parts = df['epochId'].str.split('-', expand=True)
+    storage_df = pd.DataFrame({
+        'type': pd.Categorical(id_parts[0], categories=DATA_TYPES),
+        'subject': id_parts[1].astype(np.int16),
+        'night': id_parts[2].astype(np.int8),
+        'epochNum': id_parts[3].astype(np.int32),
+    })
+    feature_columns = [column for column in df.columns if column not in ('epochId', 'sleep_stage', *ID_COLUMNS)]
+    for column in feature_columns:
+        storage_df[column] = df[column].to_numpy(dtype=np.float32)
+    if 'sleep_stage' in df.columns:
+        storage_df['sleep_stage'] = pd.Categorical(df['sleep_stage'].astype(str), categories=SLEEP_STAGES)
+
+    return storage_df
+
+def make_epoch_id_column(df):
+    return df['type'].astype(str) + '-' + df['subject'].astype(str).str.zfill(2) + '-' + df['night'].astype(str) + '-' + df['epochNum'].astype(str).str.zfill(4)
+
+def save_table(df, table_path):
+    storage_df = to_storage_frame(df) if 'epochId' in df.columns else df
+    storage_df.to_parquet(f'{table_path}.parquet', index=False, row_group_size=TABLE_ROW_GROUP_ROWS)
+    return f'{table_path}.parquet'
+
+def load_table(table_path, columns=None):
+    # epochId is rebuilt on request from the id columns, so it can still be selected like a stored column
+    read_columns = None
+    if columns is not None:
+        read_columns = [column for column in columns if column != 'epochId']
+        if 'epochId' in columns:
+            read_columns += [column for column in ID_COLUMNS if column not in read_columns]
+
+    if os.path.exists(f'{table_path}.parquet'):
+        df = pd.read_parquet(f'{table_path}.parquet', columns=read_columns)
+    elif os.path.exists(f'{table_path}.csv'):
+        # legacy CSV tables are normalised to the storage layout on import
+        df = to_storage_frame(pd.read_csv(f'{table_path}.csv', dtype={'sleep_stage': str}))
+        if read_columns is not None:
+            df = df[read_columns]
+    else:
+        raise FileNotFoundError(f'No table found at {table_path}.parquet or {table_path}.csv')
+
+    if columns is None or 'epochId' in columns:
+        df.insert(0, 'epochId', make_epoch_id_column(df))
+    if columns is not None:
+        df = df[columns]
+
+    return df
+
+def convert_csv_table(table_path):
+    df = pd.read_csv(f'{table_path}.csv', dtype={'sleep_stage': str})
+    return save_table(df, table_path)
@@ -0,0 +1,65 @@
+import os
+import sys
+import numpy as np
+
+# run from the repository root, e.g. python model/testing/band_power.test.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from band_power import EPOCH_LENGTH, SlidingBandPower, compute_power_bands_batch
+
+POWER_RTOL = 1e-9 # sliding DFT against a fresh FFT, after many updates
+RATIO_ATOL = 1e-5 + 1e-12 # ratios are rounded to 5 decimals, so a value on a rounding edge may land one step away
+
+def make_signals(rng, n_channels, n_samples, sampling_frequency):
+    # noise plus slow drift and a few rhythms, a DC offset so subdelta and the total are not trivially small
+    t = np.arange(n_samples) / sampling_frequency
+    rhythms = sum(amplitude * np.sin(2 * np.pi * frequency * t + rng.uniform(0, 2 * np.pi)) for frequency, amplitude in ((0.3, 40), (2, 30), (10, 15), (25, 5)))
+    return 20 * rng.standard_normal((n_channels, n_samples)) + rhythms + rng.uniform(-50, 50, (n_channels, 1))
+
+def check_stream(signals, window_size, sampling_frequency, chunk_sizes, name, resync_interval=None):
+    # feeds the stream in chunks and compares every full window with compute_power_bands_batch on the same samples
+    sliding_band_power = SlidingBandPower(window_size, sampling_frequency, signals.shape[0], resync_interval)
+    position = 0
+    windows = 0
+    for chunk_size in chunk_sizes:
+        sliding_band_power.update(signals[:, position:position + chunk_size])
+        position += chunk_size
+        if position < window_size:
+            continue
+
+        power_bands, power_ratios = sliding_band_power.power_bands()
+        expected_bands, expected_ratios = compute_power_bands_batch(signals[:, position - window_size:position], sampling_frequency)
+        np.testing.assert_allclose(power_bands, expected_bands, rtol=POWER_RTOL, err_msg=f'{name}: band powers differ after {position} samples')
+        np.testing.assert_allclose(power_ratios, expected_ratios, rtol=0, atol=RATIO_ATOL, err_msg=f'{name}: ratios differ after {position} samples')
+        windows += 1
+    return windows
+
+def test_hops(seed=0):
+    # the device rate, the training rate and an odd window without a Nyquist bin
+    rng = np.random.default_rng(seed)
+    for sampling_frequency, window_size in ((256, EPOCH_LENGTH * 256), (100, EPOCH_LENGTH * 100), (100, 2999)):
+        signals = make_signals(rng, 2, 5 * window_size, sampling_frequency)
+        for hop in (1, 7, sampling_frequency, 5 * sampling_frequency, window_size, window_size + 13):
+            n_chunks = min(signals.shape[1] // hop, 3 * window_size // hop + 40)
+            windows = check_stream(signals, window_size, sampling_frequency, [hop] * n_chunks, f'{sampling_frequency} Hz, window {window_size}, hop {hop}')
+            assert windows > 0
+        print(f'{sampling_frequency} Hz, window {window_size}: every hop matches')
+
+def test_uneven_chunks(seed=1):
+    rng = np.random.default_rng(seed)
+    signals = make_signals(rng, 2, 20 * 3000, 100)
+    chunk_sizes = rng.integers(1, 4000, 200)
+    chunk_sizes = chunk_sizes[np.cumsum(chunk_sizes) <= signals.shape[1]]
+    windows = check_stream(signals, 3000, 100, chunk_sizes, 'uneven chunks')
+    print(f'uneven chunks: {windows} windows match')
+
+def test_without_resync(seed=2):
+    # rounding drift over a long stream stays far below the tolerance even when resyncs are rare
+    rng = np.random.default_rng(seed)
+    signals = make_signals(rng, 2, 40 * 3000, 100)
+    windows = check_stream(signals, 3000, 100, [500] * (signals.shape[1] // 500), 'rare resync', resync_interval=signals.shape[1])
+    print(f'rare resync: {windows} windows match')
+
+if __name__ == "__main__":
+    test_hops()
+    test_uneven_chunks()
+    test_without_resync()
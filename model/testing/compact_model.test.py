@@ -0,0 +1,95 @@
+import os
+import sys
+import tempfile
+import numpy as np
+import lightgbm as lgb
+from sklearn.preprocessing import MaxAbsScaler
+
+# run from the repository root, e.g. python model/testing/compact_model.test.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from compact_model import export_model, load_compact_model, predict_proba_compact
+
+PROBABILITY_ATOL = 1e-15 # both sum the same leaf values in the same order, so only the final sigmoid may round differently
+N_FEATURES = 22
+
+def make_data(rng, n_rows, nan_fraction=0.0, zero_fraction=0.0):
+    # skewed positive columns like band powers, with a label that needs several splits to separate
+    X = np.exp(rng.normal(0, 2, (n_rows, N_FEATURES)))
+    y = ((np.log(X[:, 0]) + np.log(X[:, 3]) - np.log(X[:, 7]) + rng.normal(0, 1, n_rows)) > 0).astype(int)
+    X[rng.random(X.shape) < zero_fraction] = 0.0
+    X[rng.random(X.shape) < nan_fraction] = np.nan
+    return X, y
+
+def check_model(model, scaler, X, name):
+    # the compact model scales X itself, LightGBM is given the scaled rows it was trained on
+    with tempfile.TemporaryDirectory() as export_dir:
+        export_path = os.path.join(export_dir, 'model.npz')
+        export_model(model, scaler, [f'feature_{i}' for i in range(N_FEATURES)], export_path)
+        compact_model = load_compact_model(export_path)
+
+    expected = model.predict_proba(X / scaler.scale_)[:, 1] if hasattr(model, 'predict_proba') else model.predict(X / scaler.scale_)
+    probabilities = predict_proba_compact(compact_model, X)
+    difference = np.max(np.abs(probabilities - expected))
+    assert difference <= PROBABILITY_ATOL, f'{name}: probabilities differ by up to {difference}'
+    print(f'{name}: {len(X)} rows, {compact_model["metadata"]["num_trees"]} trees, max difference {difference:.1e}')
+
+def fit_classifier(X, y, **params):
+    scaler = MaxAbsScaler().fit(np.nan_to_num(X))
+    model = lgb.LGBMClassifier(n_estimators=60, num_leaves=63, verbose=-1, **params)
+    return model.fit(X / scaler.scale_, y), scaler
+
+def test_classifier(seed=0):
+    rng = np.random.default_rng(seed)
+    X, y = make_data(rng, 4000)
+    model, scaler = fit_classifier(X, y)
+    check_model(model, scaler, make_data(rng, 20000)[0], 'classifier')
+
+def test_missing_values(seed=1):
+    # NaN splits, zero-as-missing splits, and NaN read as zero when no split treats it as missing
+    rng = np.random.default_rng(seed)
+    X, y = make_data(rng, 4000, nan_fraction=0.1, zero_fraction=0.1)
+    X_test = make_data(rng, 20000, nan_fraction=0.1, zero_fraction=0.1)[0]
+    for name, params in (('NaN as missing', {}), ('zero as missing', {'zero_as_missing': True}), ('missing disabled', {'use_missing': False})):
+        model, scaler = fit_classifier(X, y, **params)
+        check_model(model, scaler, X_test, name)
+
+def test_early_stopping(seed=2):
+    # only the trees up to best_iteration_ are exported, as predict_proba uses
+    rng = np.random.default_rng(seed)
+    X, y = make_data(rng, 4000)
+    X_valid, y_valid = make_data(rng, 1000)
+    scaler = MaxAbsScaler().fit(X)
+    model = lgb.LGBMClassifier(n_estimators=500, learning_rate=0.3, verbose=-1)
+    model.fit(X / scaler.scale_, y, eval_set=[(X_valid / scaler.scale_, y_valid)], callbacks=[lgb.early_stopping(5, verbose=False)])
+    assert model.best_iteration_ < 500
+    check_model(model, scaler, make_data(rng, 20000)[0], f'early stopping at {model.best_iteration_}')
+
+def test_booster(seed=3):
+    # out-of-core training saves a bare Booster
+    rng = np.random.default_rng(seed)
+    X, y = make_data(rng, 4000)
+    scaler = MaxAbsScaler().fit(X)
+    booster = lgb.train({'objective': 'binary', 'num_leaves': 31, 'verbose': -1}, lgb.Dataset(X / scaler.scale_, label=y), num_boost_round=40)
+    check_model(booster, scaler, make_data(rng, 20000)[0], 'booster')
+
+def test_bare_file_name(seed=4):
+    # a path without a directory is written to the working directory
+    rng = np.random.default_rng(seed)
+    X, y = make_data(rng, 500)
+    model, scaler = fit_classifier(X, y)
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as export_dir:
+        os.chdir(export_dir)
+        try:
+            export_model(model, scaler, [f'feature_{i}' for i in range(N_FEATURES)], 'model.npz')
+            assert os.path.exists(os.path.join(export_dir, 'model.npz'))
+        finally:
+            os.chdir(working_directory)
+    print('bare file name: ok')
+
+if __name__ == "__main__":
+    test_classifier()
+    test_missing_values()
+    test_early_stopping()
+    test_booster()
+    test_bare_file_name()
@@ -0,0 +1,72 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+# run from the repository root, e.g. python model/testing/generate_labels.test.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from preprocessing_functions import EPOCH_LENGTH, extract_annotations, generate_labels, list_night_files
+
+def generate_labels_reference(annotations_df, data_type, subject_number, night_number):
+    # the epoch-by-epoch scan generate_labels replaced, kept as the reference it must agree with
+    labels_list = []
+    epochs = int((annotations_df.iloc[-1]['onset'] + annotations_df.iloc[-1]['duration']) // 30)
+
+    for epoch in range(epochs):
+        min_timestamp = epoch * 30
+        max_timestamp = (epoch + 1) * 30
+        epoch_id = f"{data_type}-{subject_number}-{night_number}-{epoch:04d}"
+        interval_epoch_annotations = annotations_df[(annotations_df['onset'] < max_timestamp) & (annotations_df['end'] > min_timestamp)]
+        if len(interval_epoch_annotations) == 0:
+            sleep_stage = 'N' # no label available
+        elif len(interval_epoch_annotations) == 1:
+            sleep_stage = interval_epoch_annotations.iloc[0]['sleep_stage']
+        else:
+            sleep_stage = 'T' # transition epoch
+        labels_list.append({
+            'epochId': epoch_id,
+            'sleep_stage': sleep_stage
+        })
+
+    return pd.DataFrame(labels_list, columns=['epochId', 'sleep_stage'])
+
+def make_random_annotations(rng, n_annotations):
+    # onsets off the epoch grid, with gaps, overlaps and long annotations that swallow shorter ones
+    onsets = np.sort(rng.uniform(0, n_annotations * 60, n_annotations))
+    durations = rng.choice([0.0, 15.0, 30.0, 45.0, 90.0, 600.0], n_annotations) + rng.uniform(0, 10, n_annotations) * rng.integers(0, 2, n_annotations)
+    annotations_df = pd.DataFrame({'onset': onsets, 'duration': durations, 'end': onsets + durations, 'sleep_stage': rng.choice(list('W123R?M'), n_annotations)})
+    return annotations_df.iloc[rng.permutation(n_annotations)].reset_index(drop=True)
+
+def check_labels(annotations_df, name):
+    expected = generate_labels_reference(annotations_df, 'cassette', '00', '1')
+    labels_df = generate_labels(annotations_df, 'cassette', '00', '1')
+    assert labels_df['epochId'].tolist() == expected['epochId'].tolist(), f'{name}: epoch ids differ'
+    mismatches = np.flatnonzero(labels_df['sleep_stage'].to_numpy() != expected['sleep_stage'].to_numpy())
+    assert len(mismatches) == 0, f'{name}: {len(mismatches)} labels differ, first at epoch {mismatches[0]}'
+    return len(labels_df)
+
+def test_random_annotations(trials=200, seed=0):
+    rng = np.random.default_rng(seed)
+    epochs = sum(check_labels(make_random_annotations(rng, rng.integers(1, 80)), f'random set {trial}') for trial in range(trials))
+    print(f'random annotations: {trials} sets, {epochs} epochs match')
+
+def test_hypnograms():
+    # every hypnogram downloaded to data/physionet
+    hypnograms = list_night_files(hypnogram=True)
+    for edfp_file in hypnograms:
+        annotations_df, *_ = extract_annotations(edfp_file)
+        check_labels(annotations_df, edfp_file)
+    print(f'hypnograms: {len(hypnograms)} nights match')
+
+def test_epoch_boundaries():
+    # annotations that end exactly on an epoch start do not overlap it
+    annotations_df = pd.DataFrame({'onset': [0.0, EPOCH_LENGTH, 2.5 * EPOCH_LENGTH], 'duration': [EPOCH_LENGTH, 1.5 * EPOCH_LENGTH, 1.5 * EPOCH_LENGTH], 'sleep_stage': ['W', '1', '2']})
+    annotations_df['end'] = annotations_df['onset'] + annotations_df['duration']
+    check_labels(annotations_df, 'epoch boundaries')
+    assert generate_labels(annotations_df, 'cassette', '00', '1')['sleep_stage'].tolist() == ['W', '1', 'T', '2']
+    print('epoch boundaries: ok')
+
+if __name__ == "__main__":
+    test_epoch_boundaries()
+    test_random_annotations()
+    test_hypnograms()
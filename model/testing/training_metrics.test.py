@@ -0,0 +1,95 @@
+import os
+import sys
+import warnings
+import numpy as np
+from sklearn.metrics import accuracy_score, roc_auc_score, precision_score, recall_score, f1_score, log_loss, confusion_matrix, precision_recall_curve, auc, matthews_corrcoef
+
+# run from the repository root, e.g. python model/testing/training_metrics.test.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from training_metrics import METRICS, THRESHOLD, get_split_metrics, pool_fold_metrics
+
+METRIC_TOLERANCE = 1e-12 # same sums in a different order
+
+def get_sklearn_metrics(y_true, y_prob, pr_curve_order=False):
+    # the calls train_model made before training_metrics, y_pred as LGBMClassifier.predict gives it
+    y_pred = (y_prob > THRESHOLD).astype(int)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning) # single-class splits and zero divisions, UndefinedMetricWarning among them
+        precision, recall, _ = precision_recall_curve(y_true, y_prob)
+        if not pr_curve_order:
+            recall, precision = zip(*sorted(zip(recall, precision))) # as cross validation sorted the curve
+        return {
+            'accuracy': accuracy_score(y_true, y_pred),
+            'roc_auc': roc_auc_score(y_true, y_prob) if 0 < np.sum(y_true) < len(y_true) else float('nan'),
+            'precision': precision_score(y_true, y_pred),
+            'recall': recall_score(y_true, y_pred),
+            'f1': f1_score(y_true, y_pred),
+            'log_loss': log_loss(y_true, y_prob, labels=[0, 1]),
+            'auc_pr': auc(recall, precision),
+            'mcc': matthews_corrcoef(y_true, y_pred),
+            'conf_matrix': confusion_matrix(y_true, y_pred, labels=[0, 1]),
+        }
+
+def check_metrics(metrics, expected, name):
+    for metric in METRICS:
+        if np.isnan(expected[metric]):
+            assert np.isnan(metrics[metric]), f'{name}: {metric} is {metrics[metric]}, expected nan'
+        else:
+            assert abs(metrics[metric] - expected[metric]) <= METRIC_TOLERANCE, f'{name}: {metric} is {metrics[metric]}, expected {expected[metric]}'
+    assert np.array_equal(metrics['conf_matrix'], expected['conf_matrix']), f'{name}: confusion matrices differ'
+
+def make_scores(rng, n_rows, positive_rate, decimals=None):
+    # scores loosely tied to the label, rounded so many rows share a score and the curves have ties
+    y_true = (rng.random(n_rows) < positive_rate).astype(int)
+    y_prob = 1 / (1 + np.exp(-(rng.normal(0, 1.5, n_rows) + 2 * y_true - 1)))
+    if decimals is not None:
+        y_prob = np.round(y_prob, decimals)
+    return y_true, y_prob
+
+def test_random_scores(trials=300, seed=0):
+    rng = np.random.default_rng(seed)
+    for trial in range(trials):
+        y_true, y_prob = make_scores(rng, int(rng.integers(2, 3000)), rng.uniform(0.02, 0.98), rng.choice([None, 1, 2, 3]))
+        for pr_curve_order in (False, True):
+            check_metrics(get_split_metrics(y_true, y_prob, pr_curve_order=pr_curve_order), get_sklearn_metrics(y_true, y_prob, pr_curve_order), f'trial {trial}')
+    print(f'random scores: {trials} splits match')
+
+def test_edge_cases():
+    # one class only, nothing predicted positive, everything predicted positive, scores on the threshold and at 0 and 1
+    cases = {
+        'only negatives': (np.zeros(50, dtype=int), np.linspace(0, 0.9, 50)),
+        'only positives': (np.ones(50, dtype=int), np.linspace(0.1, 1, 50)),
+        'none predicted positive': (np.r_[np.zeros(30, dtype=int), np.ones(20, dtype=int)], np.full(50, 0.2)),
+        'all predicted positive': (np.r_[np.zeros(30, dtype=int), np.ones(20, dtype=int)], np.full(50, 0.8)),
+        'scores on the threshold': (np.array([0, 1, 0, 1, 1, 0]), np.array([0.5, 0.5, 0.4, 0.6, 0.5, 0.7])),
+        'certain scores': (np.array([0, 1, 1, 0, 1]), np.array([0.0, 1.0, 0.0, 1.0, 1.0])),
+    }
+    for name, (y_true, y_prob) in cases.items():
+        for pr_curve_order in (False, True):
+            check_metrics(get_split_metrics(y_true, y_prob, pr_curve_order=pr_curve_order), get_sklearn_metrics(y_true, y_prob, pr_curve_order), name)
+    print(f'edge cases: {len(cases)} cases match')
+
+def test_pooled_metrics(seed=1):
+    # micro pooling matches sklearn on every fold's predictions as one set, with or without the scores
+    rng = np.random.default_rng(seed)
+    folds = [make_scores(rng, int(rng.integers(100, 2000)), rng.uniform(0.1, 0.5), 2) for _ in range(12)]
+    fold_metrics = [get_split_metrics(y_true, y_prob) for y_true, y_prob in folds]
+    y_true = np.concatenate([fold[0] for fold in folds])
+    y_prob = np.concatenate([fold[1] for fold in folds])
+    expected = get_sklearn_metrics(y_true, y_prob)
+
+    macro, micro = pool_fold_metrics(fold_metrics, y_true, y_prob)
+    check_metrics(micro, expected, 'pooled with scores')
+    for metric in METRICS:
+        assert abs(macro[metric] - np.mean([fold[metric] for fold in fold_metrics])) <= METRIC_TOLERANCE, f'macro {metric} is not the fold mean'
+
+    _, micro = pool_fold_metrics(fold_metrics)
+    for metric in ('accuracy', 'precision', 'recall', 'f1', 'mcc', 'log_loss'):
+        assert abs(micro[metric] - expected[metric]) <= METRIC_TOLERANCE, f'pooled without scores: {metric} is {micro[metric]}, expected {expected[metric]}'
+    assert np.array_equal(micro['conf_matrix'], expected['conf_matrix'])
+    print('pooled metrics: ok')
+
+if __name__ == "__main__":
+    test_random_scores()
+    test_edge_cases()
+    test_pooled_metrics()
@@ -0,0 +1,108 @@
+import numpy as np
+
+# Binary metrics for the N1/N2 classifier, computed from one sort of the scores and one set of confusion counts.
+# They reproduce the sklearn metrics train_model used to call one by one.
+METRICS = ['accuracy', 'roc_auc', 'precision', 'recall', 'f1', 'log_loss', 'auc_pr', 'mcc']
+THRESHOLD = 0.5 # a score above it predicts N1/N2, as LGBMClassifier.predict
+LOG_LOSS_EPS = np.finfo(np.float64).eps # log_loss clips probabilities to [eps, 1 - eps]
+
+def safe_divide(numerator, denominator):
+    # 0 where the denominator is 0, sklearn's zero_division default
+    numerator, denominator = np.broadcast_arrays(np.asarray(numerator, dtype=np.float64), np.asarray(denominator, dtype=np.float64))
+    return np.divide(numerator, denominator, out=np.zeros(numerator.shape), where=denominator != 0)
+
+def trapezoid(y, x):
+    return float((np.diff(x) * (y[1:] + y[:-1]) / 2.0).sum())
+
+def get_count_metrics(tn, fp, fn, tp):
+    """Threshold metrics from confusion counts, elementwise, so arrays of fold counts give arrays of metrics."""
+    tn, fp, fn, tp = (np.asarray(count, dtype=np.float64) for count in (tn, fp, fn, tp))
+    n = tn + fp + fn + tp
+    # matthews_corrcoef's covariance form, true and predicted class totals against each other
+    true_negatives, true_positives = tn + fp, fn + tp
+    predicted_negatives, predicted_positives = tn + fn, fp + tp
+    cov_ytyp = (tn + tp) * n - (true_negatives * predicted_negatives + true_positives * predicted_positives)
+    cov_ypyp = n ** 2 - (predicted_negatives ** 2 + predicted_positives ** 2)
+    cov_ytyt = n ** 2 - (true_negatives ** 2 + true_positives ** 2)
+    return {
+        'accuracy': safe_divide(tn + tp, n),
+        'precision': safe_divide(tp, tp + fp),
+        'recall': safe_divide(tp, tp + fn),
+        'f1': safe_divide(2 * tp, 2 * tp + fp + fn),
+        'mcc': safe_divide(cov_ytyp, np.sqrt(cov_ypyp * cov_ytyt)),
+    }
+
+def rank_scores(y_true, y_prob):
+    """Sorts the scores once, returning cumulative true positives at every rank and at the last rank of each distinct score."""
+    y_prob = np.asarray(y_prob, dtype=np.float64)
+    order = np.argsort(y_prob, kind='mergesort')[::-1]
+    sorted_prob = y_prob[order]
+    cumulative_tps = np.cumsum(np.asarray(y_true)[order] != 0, dtype=np.int64)
+    threshold_rows = np.r_[np.flatnonzero(np.diff(sorted_prob)), len(sorted_prob) - 1]
+    tps = cumulative_tps[threshold_rows]
+    return {'sorted_prob': sorted_prob, 'cumulative_tps': cumulative_tps, 'tps': tps, 'fps': threshold_rows + 1 - tps}
+
+def get_curves(ranked):
+    # ROC and precision-recall curves as roc_curve and precision_recall_curve give them, without dropping points
+    tps, fps = ranked['tps'], ranked['fps']
+    fpr = safe_divide(np.r_[0, fps], fps[-1])
+    tpr = safe_divide(np.r_[0, tps], tps[-1])
+    precision = np.r_[(tps / (tps + fps))[::-1], 1.0]
+    # without positives precision_recall_curve sets recall to 1 at every threshold
+    recall = np.r_[(safe_divide(tps, tps[-1]) if tps[-1] else np.ones(len(tps)))[::-1], 0.0]
+    return fpr, tpr, precision, recall
+
+def get_split_metrics(y_true, y_prob, threshold=THRESHOLD, pr_curve_order=False):
+    """Every reported metric for one split, derived from a single ranking of y_prob.
+
+    AUC-PR integrates the curve sorted by recall then precision, as cross validation reports it, or with pr_curve_order
+    in the order precision_recall_curve returns it, as rapid training reports it. They only differ where recall ties.
+    """
+    y_true = np.asarray(y_true) != 0
+    y_prob = np.asarray(y_prob, dtype=np.float64)
+    ranked = rank_scores(y_true, y_prob)
+
+    # the confusion counts at the threshold are read off the same cumulative counts
+    predicted_positives = int(np.searchsorted(-ranked['sorted_prob'], -threshold, side='left'))
+    positives = int(ranked['cumulative_tps'][-1])
+    tp = int(ranked['cumulative_tps'][predicted_positives - 1]) if predicted_positives else 0
+    fp = predicted_positives - tp
+    fn = positives - tp
+    tn = len(y_true) - positives - fp
+    metrics = {metric: float(value) for metric, value in get_count_metrics(tn, fp, fn, tp).items()}
+
+    fpr, tpr, precision, recall = get_curves(ranked)
+    has_both_classes = 0 < positives < len(y_true)
+    metrics['roc_auc'] = trapezoid(tpr, fpr) if has_both_classes else float('nan')
+    if pr_curve_order:
+        metrics['auc_pr'] = -trapezoid(precision, recall) # recall decreases along the curve
+    else:
+        pr_order = np.lexsort((precision, recall))
+        metrics['auc_pr'] = trapezoid(precision[pr_order], recall[pr_order])
+    positive_prob = np.clip(y_prob, LOG_LOSS_EPS, 1 - LOG_LOSS_EPS)
+    negative_prob = np.clip(1 - y_prob, LOG_LOSS_EPS, 1 - LOG_LOSS_EPS)
+    metrics['log_loss'] = float(-np.mean(np.where(y_true, np.log(positive_prob), np.log(negative_prob))))
+    metrics['conf_matrix'] = np.array([[tn, fp], [fn, tp]])
+
+    return {metric: metrics[metric] for metric in METRICS + ['conf_matrix']}
+
+def pool_fold_metrics(fold_metrics, y_true=None, y_prob=None):
+    """Pools one split over folds as (macro, micro).
+
+    Macro is the mean of each metric over folds. Micro scores every fold's predictions as one set: threshold metrics come
+    from the summed confusion counts and log loss from the row-weighted mean, ranking metrics need the concatenated
+    y_true and y_prob and are left out without them.
+    """
+    conf_matrices = np.stack([fold['conf_matrix'] for fold in fold_metrics])
+    conf_matrix = conf_matrices.sum(axis=0)
+    macro = {metric: float(np.mean([fold[metric] for fold in fold_metrics])) for metric in METRICS}
+    macro['conf_matrix'] = conf_matrix
+
+    if y_true is not None:
+        return macro, get_split_metrics(y_true, y_prob)
+
+    micro = {metric: float(value) for metric, value in get_count_metrics(*conf_matrix.ravel()).items()}
+    fold_rows = conf_matrices.sum(axis=(1, 2))
+    micro['log_loss'] = float(np.dot(fold_rows, [fold['log_loss'] for fold in fold_metrics]) / fold_rows.sum())
+    micro['conf_matrix'] = conf_matrix
+    return macro, micro
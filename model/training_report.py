@@ -0,0 +1,176 @@
+import io
+import os
+import csv
+import json
+import time
+from training_metrics import METRICS, rank_scores, get_curves, trapezoid
+
+# Report sinks are callables taking the report dict train_model builds:
+#   train_type, finished_at, training_time, features, model_params,
+#   metrics           {'train': ..., 'test': ...} as get_split_metrics returns them (fold means in cross validation)
+#   pooled_metrics    {'train': ..., 'test': ...} pooled over folds, None in rapid mode
+#   y_test, y_test_prob  the test labels and scores the figure's curves are drawn from
+# matplotlib and seaborn are only imported when a figure is asked for.
+REPORTS_DIR = os.path.join('data', 'reports')
+SUMMARY_METRICS = ['mcc', 'auc_pr', 'roc_auc', 'f1', 'precision', 'recall', 'log_loss', 'accuracy'] # order of the printed summary line
+FIGURE_SIZE = (12, 8)
+METRIC_LABELS = {'accuracy': 'Accuracy', 'roc_auc': 'ROC AUC', 'precision': 'Precision', 'recall': 'Recall', 'f1': 'F1-score', 'log_loss': 'Log Loss', 'auc_pr': 'AUC-PR', 'mcc': 'MCC'}
+
+def get_counts(conf_matrix):
+    return {'tp': int(conf_matrix[1][1]), 'tn': int(conf_matrix[0][0]), 'fp': int(conf_matrix[0][1]), 'fn': int(conf_matrix[1][0])}
+
+def get_summary_row(report):
+    # the figures of the summary line, test then train, then the training time
+    row = {}
+    for split in ('test', 'train'):
+        row.update({f'{split}_{metric}': report['metrics'][split][metric] for metric in SUMMARY_METRICS})
+        row.update({f'{split}_{count}': value for count, value in get_counts(report['metrics'][split]['conf_matrix']).items()})
+    row['training_time'] = report['training_time']
+    return row
+
+def print_report(report):
+    """Prints the metrics and the summary line, the console report train_model has always given."""
+    for split, heading in (('train', '-- TRAINING METRICS --'), ('test', '\n-- TESTING METRICS --')):
+        print(heading)
+        for metric in METRICS:
+            print(f"{split.capitalize()} {METRIC_LABELS[metric]}: {report['metrics'][split][metric]}")
+        print(f"{split.capitalize()} Confusion Matrix:\n{report['metrics'][split]['conf_matrix']}")
+
+    print('\n -- MODEL PERFORMANCE SUMMARY --')
+    print(f"{', '.join(str(value) for value in get_summary_row(report).values())}\n")
+
+    if report['pooled_metrics'] is not None:
+        print('-- POOLED OUT-OF-FOLD METRICS --')
+        for split in ('train', 'test'):
+            for metric, value in report['pooled_metrics'][split].items():
+                print(f"{split.capitalize()} {metric}: {value}")
+        print()
+
+def get_metric_rows(report):
+    # one row per split, macro and pooled, with the confusion matrix as counts
+    splits = {split: report['metrics'][split] for split in ('train', 'test')}
+    if report['pooled_metrics'] is not None:
+        splits.update({f'pooled_{split}': report['pooled_metrics'][split] for split in ('train', 'test')})
+    return [{'split': split, **{metric: split_metrics.get(metric) for metric in METRICS}, **get_counts(split_metrics['conf_matrix'])} for split, split_metrics in splits.items()]
+
+def save_metrics_json(report, path):
+    report_json = {key: report[key] for key in ('train_type', 'finished_at', 'training_time', 'features', 'model_params')}
+    report_json['metrics'] = {row.pop('split'): row for row in get_metric_rows(report)}
+    with open(path, 'w') as json_file:
+        json.dump(report_json, json_file, indent=2)
+
+def save_metrics_csv(report, path):
+    rows = get_metric_rows(report)
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+def append_summary(report, path):
+    """Appends the run's summary line to a CSV shared by a sweep, writing the header when the file is new."""
+    row = {'finished_at': report['finished_at'], 'train_type': report['train_type'], **get_summary_row(report), 'model_params': json.dumps(report['model_params'], sort_keys=True)}
+    lines = io.StringIO()
+    writer = csv.DictWriter(lines, fieldnames=list(row))
+    if not os.path.exists(path):
+        writer.writeheader()
+    writer.writerow(row)
+    # one write per run, so runs appending from several processes do not interleave their lines
+    with open(path, 'a', newline='') as summary_file:
+        summary_file.write(lines.getvalue())
+
+def plot_report(report, figure=None):
+    """Draws the ROC curve, PR curve, confusion matrix and metrics table, onto a new headless Figure unless one is given."""
+    from matplotlib.figure import Figure
+    import pandas as pd
+    import seaborn as sns
+
+    figure = Figure(figsize=FIGURE_SIZE) if figure is None else figure
+    axes = figure.subplots(2, 2)
+    train_metrics, test_metrics = report['metrics']['train'], report['metrics']['test']
+    fpr, tpr, precision, recall = get_curves(rank_scores(report['y_test'], report['y_test_prob']))
+    auc_pr = -trapezoid(precision, recall)
+
+    # ROC Curve
+    axes[0, 0].plot(fpr, tpr, color='darkorange', lw=2, label='ROC curve (AUC = %0.3f)' % test_metrics['roc_auc'])
+    axes[0, 0].plot([0, 1], [0, 1], color='navy', lw=2, linestyle='--')
+    axes[0, 0].set_xlim([0.0, 1.0])
+    axes[0, 0].set_ylim([0.0, 1.05])
+    axes[0, 0].set_xlabel('False Positive Rate')
+    axes[0, 0].set_ylabel('True Positive Rate')
+    axes[0, 0].set_title('ROC Curve')
+    axes[0, 0].legend(loc="lower right")
+
+    # Precision-Recall Curve
+    axes[0, 1].plot(recall, precision, color='blue', lw=2, label='Precision-Recall Curve (AUC = %0.3f)' % auc_pr)
+    axes[0, 1].set_xlabel('Recall')
+    axes[0, 1].set_ylabel('Precision')
+    axes[0, 1].set_title('Precision-Recall Curve')
+    axes[0, 1].legend(loc="lower left")
+
+    # Confusion Matrix
+    sns.heatmap(test_metrics['conf_matrix'], annot=True, fmt='d', cmap='Blues', xticklabels=['Other', 'N1/N2 Sleep'], yticklabels=['Other', 'N1/N2 Sleep'], ax=axes[1, 0], cbar=False)
+    axes[1, 0].set_xlabel('Predicted')
+    axes[1, 0].set_ylabel('Actual')
+    axes[1, 0].set_title('Confusion Matrix')
+
+    # Metrics Table
+    table_metrics = ['mcc', 'auc_pr', 'f1', 'roc_auc', 'log_loss', 'precision', 'recall', 'accuracy']
+    metrics_df = pd.DataFrame({
+        'Metric': ['MCC', 'AUC-PR', 'F1-Score', 'ROC AUC', 'Log Loss', 'Precision', 'Recall', 'Accuracy'],
+        'Testing': [round(test_metrics[metric], 4) for metric in table_metrics],
+        'Training': [round(train_metrics[metric], 4) for metric in table_metrics],
+        'GenRatio': [round(test_metrics[metric] / train_metrics[metric], 4) if train_metrics[metric] != 0 else 0 for metric in table_metrics],
+    })
+    axes[1, 1].axis('tight')
+    axes[1, 1].axis('off')
+    table = axes[1, 1].table(cellText=metrics_df.values, colLabels=metrics_df.columns, cellLoc='center', loc='center', colColours=['#f2f2f2']*4)
+    table.auto_set_font_size(False)
+    table.set_fontsize(12)
+    table.scale(1.2, 1.2)
+    for (i, j), cell in table.get_celld().items():
+        cell.set_edgecolor('black')
+        if i == 0:
+            cell.set_text_props(weight='bold', color='white')
+            cell.set_facecolor('#40466e')
+        cell.set_height(0.1)
+    axes[1, 1].set_title('Metrics Summary')
+
+    figure.tight_layout(pad=3.0)
+    return figure
+
+class ReportWriter:
+    """Report sink writing metrics.json and metrics.csv to report_dir, the figure is only drawn when saved or shown."""
+
+    def __init__(self, report_dir, summary_path=None, save_figure=False, show_figure=False):
+        self.report_dir = report_dir
+        self.summary_path = summary_path
+        self.save_figure = save_figure
+        self.show_figure = show_figure
+
+    def __call__(self, report):
+        os.makedirs(self.report_dir, exist_ok=True)
+        save_metrics_json(report, os.path.join(self.report_dir, 'metrics.json'))
+        save_metrics_csv(report, os.path.join(self.report_dir, 'metrics.csv'))
+        if self.summary_path is not None:
+            append_summary(report, self.summary_path)
+
+        if self.save_figure or self.show_figure:
+            self.write_figure(report)
+
+    def write_figure(self, report):
+        figure_path = os.path.join(self.report_dir, 'report.png')
+        if not self.show_figure:
+            plot_report(report).savefig(figure_path)
+            return
+
+        # pyplot, and with it a GUI backend, only when a window is wanted
+        import matplotlib.pyplot as plt
+        figure = plot_report(report, plt.figure(figsize=FIGURE_SIZE))
+        if self.save_figure:
+            figure.savefig(figure_path)
+        plt.show()
+        plt.close(figure)
+
+def get_report_dir(train_type, reports_dir=REPORTS_DIR):
+    # one directory per run, e.g. data/reports/rapid-20240101-120000
+    return os.path.join(reports_dir, f"{train_type}-{time.strftime('%Y%m%d-%H%M%S')}")